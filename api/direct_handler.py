@@ -0,0 +1,140 @@
+from typing import Any, Awaitable, Callable, Hashable
+
+from api.schemas import DataBlogger, DataJob, DataThread
+from base.exceptions import APIException, ErrorCode
+from base.http import http_clients
+from base.jobs import Job, JobRegistry
+from base.sharding import Shard
+from base.singleflight import SingleFlight
+from configs import CONSUMER_HOSTS, DIRECT_JOBS_CACHE_SIZE, DIRECT_JOBS_TTL
+from fastapi import APIRouter, status
+from manager import DirectManager
+
+direct_router = APIRouter()
+
+
+class DirectJobs:
+    """
+    Runs sync and generation of one blogger or thread in the background with the DirectManager methods
+    the workers use. Requests for a run that is already in flight get the handle of that run.
+    Delivery is left to the consumer, which is only asked to poll for messages right away.
+    """
+
+    def __init__(self) -> None:
+        self.registry = JobRegistry(maxsize=DIRECT_JOBS_CACHE_SIZE, ttl=DIRECT_JOBS_TTL)
+        # Jobs of different kinds for one blogger share a single inbox fetch
+        self._syncs = SingleFlight()
+
+    async def stop(self) -> None:
+        await self.registry.stop()
+
+    def run(self, kind: str, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Job:
+        return self.registry.start(kind, (kind, key), func)
+
+    @staticmethod
+    async def get_active_blogger(blogger_id: int) -> DataBlogger:
+        bloggers = DirectManager.iter_active_bloggers()
+        try:
+            async for blogger in bloggers:
+                if blogger is not None and blogger.id == blogger_id:
+                    return blogger
+        finally:
+            await bloggers.aclose()
+        raise LookupError(f"Active blogger with id '{blogger_id}' wasn't found")
+
+    async def sync_threads(self, manager: DirectManager, blogger: DataBlogger) -> list[DataThread]:
+        return await self._syncs.do(blogger.id, lambda: self._sync_threads(manager, blogger))
+
+    @staticmethod
+    async def _sync_threads(manager: DirectManager, blogger: DataBlogger) -> list[DataThread]:
+        """
+        Saves the whole inbox of the blogger. The fingerprints and the sync watermark are state of the publisher
+        process, so they aren't used to skip threads here.
+        The backend gives the cached client of a login to one call at a time, also across jobs and webhooks.
+        """
+        threads = await manager.fetch_threads_by_blogger(blogger)
+        if not threads:
+            return []
+        # The sync watermark belongs to the publisher, threads it hasn't seen yet are still fetched by it
+        saved_threads = await manager.save_threads(blogger, threads, update_watermark=False)
+        return [thread for thread in saved_threads if thread is not None]
+
+    async def sync(self, blogger_id: int) -> dict:
+        manager = DirectManager()
+        blogger = await self.get_active_blogger(blogger_id)
+        threads = await self.sync_threads(manager, blogger)
+        return {"threads_saved": len(threads)}
+
+    async def generate(self, blogger_id: int) -> dict:
+        manager = DirectManager()
+        blogger = await self.get_active_blogger(blogger_id)
+        threads = await self.sync_threads(manager, blogger)
+        answers = await manager.get_generated_answer_based_on_blogger_threads_and_save(threads) if threads else []
+        return {"threads_saved": len(threads), "answers_saved": len(answers)}
+
+    async def generate_for_thread(self, blogger_id: int, thread_id: int) -> dict:
+        manager = DirectManager()
+        blogger = await self.get_active_blogger(blogger_id)
+        threads = await self.sync_threads(manager, blogger)
+        thread = next((thread for thread in threads if thread.id == thread_id), None)
+        if thread is None:
+            raise LookupError(f"Thread with id '{thread_id}' wasn't found. Blogger: {blogger.instagram_login}")
+        answer = await manager.get_generated_answer_based_on_thread_and_save(thread)
+        return {"generated_message_id": answer.id if answer else None}
+
+    @staticmethod
+    async def deliver(blogger_id: int) -> dict:
+        # The consumer shard owning the blogger sends its messages, with its own rate limits and status buffer
+        shard_index = Shard(0, len(CONSUMER_HOSTS)).get_owner(blogger_id)
+        async with http_clients.consumer.post(
+            f"{CONSUMER_HOSTS[shard_index]}/deliver", endpoint="/deliver", params={"blogger_id": blogger_id}
+        ) as response:
+            response.raise_for_status()
+        return {"consumer_shard": shard_index}
+
+
+direct_jobs = DirectJobs()
+
+
+@direct_router.post("/bloggers/{blogger_id}/sync", response_model=DataJob, status_code=status.HTTP_202_ACCEPTED)
+async def sync_blogger_threads(blogger_id: int):
+    return direct_jobs.run("sync", blogger_id, lambda: direct_jobs.sync(blogger_id)).as_dict()
+
+
+@direct_router.post("/bloggers/{blogger_id}/generate", response_model=DataJob, status_code=status.HTTP_202_ACCEPTED)
+async def generate_blogger_answers(blogger_id: int):
+    return direct_jobs.run("generate", blogger_id, lambda: direct_jobs.generate(blogger_id)).as_dict()
+
+
+@direct_router.post(
+    "/bloggers/{blogger_id}/threads/{thread_id}/generate",
+    response_model=DataJob,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def generate_thread_answer(blogger_id: int, thread_id: int):
+    return direct_jobs.run(
+        "generate_thread", (blogger_id, thread_id), lambda: direct_jobs.generate_for_thread(blogger_id, thread_id)
+    ).as_dict()
+
+
+@direct_router.post("/bloggers/{blogger_id}/deliver", response_model=DataJob, status_code=status.HTTP_202_ACCEPTED)
+async def deliver_blogger_messages(blogger_id: int):
+    if not CONSUMER_HOSTS:
+        raise APIException(
+            error_code=ErrorCode.direct_delivery_disabled,
+            status_code=status.HTTP_403_FORBIDDEN,
+            message="No consumer hosts are configured, messages are delivered with the next consumer poll",
+        )
+    return direct_jobs.run("deliver", blogger_id, lambda: direct_jobs.deliver(blogger_id)).as_dict()
+
+
+@direct_router.get("/jobs/{job_id}", response_model=DataJob)
+async def get_job(job_id: str):
+    job = direct_jobs.registry.get(job_id)
+    if job is None:
+        raise APIException(
+            error_code=ErrorCode.direct_job_not_found,
+            status_code=status.HTTP_404_NOT_FOUND,
+            message=f"Job with id '{job_id}' wasn't found",
+        )
+    return job.as_dict()
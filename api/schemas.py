@@ -56,6 +56,12 @@ class DataGeneratedMessage(BaseModel):
     recipient_instagram_username: str
 
 
+class GeneratedMessageStatusUpdate(BaseModel):
+    id: int
+    status: str
+    error: Optional[str] = None
+
+
 #####################
 #       BLOGGER     #
 #####################
@@ -91,3 +97,44 @@ class DataThreadRequest(BaseModel):
 class DataThread(DataThreadRequest):
     id: int
     messages: list[DataThreadMessage] = None
+    # Set by wrapper versions that know whether the thread has a generated message waiting to be sent
+    has_unsent_generated_message: Optional[bool] = None
+
+
+#####################
+#  WRAPPER RESPONSE #
+#####################
+
+
+class WrapperResponse(BaseModel):
+    """Envelope of bulk wrapper responses, parsed straight from the raw body with `parse_raw`"""
+
+    # Cursor of the next page of paginated list endpoints, None on the last page
+    next_cursor: Optional[str] = None
+
+
+class BloggersResponse(WrapperResponse):
+    data: list[Optional[DataBlogger]]
+
+
+class BloggersWithGeneratedMessagesResponse(WrapperResponse):
+    data: list[Optional[DataBloggerWithGeneratedMessages]]
+
+
+class ThreadsResponse(WrapperResponse):
+    data: list[Optional[DataThread]]
+
+
+#####################
+#        JOB        #
+#####################
+
+
+class DataJob(BaseModel):
+    id: str
+    kind: str
+    status: str
+    created_at: float
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
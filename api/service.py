@@ -1,4 +1,6 @@
+from base.metrics import registry
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
 
 service_router = login_router = APIRouter()
 
@@ -6,3 +8,8 @@ service_router = login_router = APIRouter()
 @service_router.get("/ping")
 async def ping():
     return {"Success": True}
+
+
+@service_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return registry.render()
@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from api.schemas import DataBlogger, DataThreadMessageRequest, DataThreadRequest
+from base.cache import LRUCache
+from base.exceptions import APIException, ErrorCode
+from base.metrics import webhook_events
+from base.singleflight import SingleFlight
+from configs import (
+    FACEBOOK_APP_SECRET,
+    FACEBOOK_WEBHOOK_VERIFY_TOKEN,
+    THREADS_SYNC_MODE,
+    WEBHOOK_BLOGGERS_REFRESH_INTERVAL,
+    WEBHOOK_CONVERSATIONS_CACHE_SIZE,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+)
+from fastapi import APIRouter, Request, status
+from fastapi.responses import PlainTextResponse
+from loguru import logger
+from manager import DirectManager
+
+webhook_router = APIRouter()
+
+
+@dataclass
+class WebhookEvent:
+    """New messages of one conversation from a webhook delivery"""
+
+    account_id: str
+    user_id: str
+    messages: list[DataThreadMessageRequest]
+
+
+def is_valid_signature(body: bytes, signature: Optional[str], app_secret: str = FACEBOOK_APP_SECRET) -> bool:
+    """Checks the X-Hub-Signature-256 header, the HMAC-SHA256 of the raw body with the app secret"""
+    if not app_secret or not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(app_secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.removeprefix("sha256="))
+
+
+def format_messaging_item(account_id: str, item: dict) -> Optional[tuple[str, DataThreadMessageRequest]]:
+    """
+    Returns the conversation user id and the message of a `messaging` item, None for items without a message
+    (reads, reactions, deletions).
+
+    Docs for the payload are here:
+    https://developers.facebook.com/docs/messenger-platform/instagram/features/webhook
+    """
+    raw_message = item.get("message")
+    if not raw_message or raw_message.get("is_deleted"):
+        return None
+
+    sender_id, recipient_id = item["sender"]["id"], item["recipient"]["id"]
+    from_blogger = raw_message.get("is_echo") or sender_id == account_id
+    attachments = raw_message.get("attachments") or []
+    if raw_message.get("text"):
+        item_type, link = "text", None
+    elif attachments:
+        item_type, link = attachments[0].get("type", "attachment"), attachments[0].get("payload", {}).get("url")
+    else:
+        return None
+
+    message = DataThreadMessageRequest(
+        instagram_id_from_official_graph_api=raw_message["mid"],
+        instagram_user_id_from_official_graph_api=recipient_id,
+        created_at=item["timestamp"] / 1000,
+        sender="blogger" if from_blogger else "external_user",
+        item_type=item_type,
+        text=raw_message.get("text"),
+        link=link,
+    )
+    return (recipient_id if from_blogger else sender_id), message
+
+
+def parse_webhook_payload(payload: dict) -> list[WebhookEvent]:
+    """Groups the messages of a delivery by account and conversation user, in the order they were sent"""
+    events: dict[tuple[str, str], WebhookEvent] = {}
+    if payload.get("object") != "instagram":
+        return []
+    for entry in payload.get("entry", []):
+        account_id = str(entry["id"])
+        for item in entry.get("messaging", []):
+            result = format_messaging_item(account_id, item)
+            if result is None:
+                continue
+            user_id, message = result
+            event = events.setdefault((account_id, user_id), WebhookEvent(account_id, user_id, []))
+            event.messages.append(message)
+    for event in events.values():
+        event.messages.sort(key=lambda message: message.created_at)
+    return list(events.values())
+
+
+class WebhookProcessor:
+    """
+    Saves the threads of webhook events and generates answers for them in background workers.
+
+    Events are routed to a worker by conversation, so messages of one conversation are processed in order.
+    The blogger of an event is found by its page id or Instagram account id in the cached list of active bloggers,
+    the conversation id and username by the Graph API once per conversation. In full sync mode the whole
+    conversation is fetched instead of saving only the messages of the event.
+    """
+
+    def __init__(self, workers: int, queue_size: int, bloggers_refresh_interval: float) -> None:
+        self.bloggers_refresh_interval = bloggers_refresh_interval
+        self._queues: list[asyncio.Queue[WebhookEvent]] = [asyncio.Queue(queue_size) for _ in range(workers)]
+        self._tasks: list[asyncio.Task] = []
+        self._bloggers: dict[str, DataBlogger] = {}
+        self._bloggers_refreshed_at: Optional[float] = None
+        self._bloggers_lock = asyncio.Lock()
+        # Refreshes requested by several workers at once share one run
+        self._bloggers_refresh = SingleFlight()
+        # page id -> id of the connected Instagram account, it doesn't change
+        self._instagram_account_ids: dict[str, str] = {}
+        # (account id, user id) -> (conversation id, username)
+        self._conversations: LRUCache[tuple[str, str], tuple[str, str]] = LRUCache(
+            maxsize=WEBHOOK_CONVERSATIONS_CACHE_SIZE
+        )
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def put(self, event: WebhookEvent) -> None:
+        """Raises asyncio.QueueFull when the worker of the conversation is behind"""
+        queue = self._queues[hash((event.account_id, event.user_id)) % len(self._queues)]
+        queue.put_nowait(event)
+
+    async def _worker(self, queue: asyncio.Queue[WebhookEvent]) -> None:
+        while True:
+            event = await queue.get()
+            try:
+                await self.process(event)
+            except Exception as e:
+                webhook_events.inc(len(event.messages), result="failed")
+                logger.error(f"Error while processing webhook event of account '{event.account_id}'")
+                logger.error(str(e))
+            finally:
+                queue.task_done()
+
+    async def process(self, event: WebhookEvent) -> None:
+        blogger = await self.get_blogger(event.account_id)
+        if blogger is None:
+            webhook_events.inc(len(event.messages), result="ignored")
+            logger.debug(f"No active blogger for webhook account '{event.account_id}'")
+            return
+
+        if THREADS_SYNC_MODE == "incremental":
+            thread = await self.get_thread_with_new_messages(blogger, event)
+        else:
+            # Every save replaces the stored thread in full sync mode, so it must hold the whole conversation
+            backend = await DirectManager.get_instagram_backend(blogger)
+            thread = await backend.get_thread_by_user(event.user_id)
+        if thread is None:
+            webhook_events.inc(len(event.messages), result="ignored")
+            logger.debug(f"No conversation with user '{event.user_id}'. Blogger: {blogger.instagram_login}")
+            return
+
+        manager = DirectManager()
+        # Polling still reconciles missed events, so the webhook doesn't move the sync watermark past them
+        saved_threads = await manager.save_threads(blogger, [thread], update_watermark=False)
+        for saved_thread in saved_threads:
+            if saved_thread is not None:
+                await manager.get_generated_answer_based_on_thread_and_save(saved_thread)
+        webhook_events.inc(len(event.messages), result="processed")
+
+    async def get_thread_with_new_messages(
+        self, blogger: DataBlogger, event: WebhookEvent
+    ) -> Optional[DataThreadRequest]:
+        """Thread with the event messages only, the wrapper merges it into the stored one"""
+        conversation = await self.get_conversation(blogger, event)
+        if conversation is None:
+            return None
+        conversation_id, username = conversation
+        return DataThreadRequest(
+            instagram_id_from_official_graph_api=conversation_id,
+            thread_to_user_id_from_official_graph_api=event.user_id,
+            thread_to_username=username,
+            messages=event.messages,
+        )
+
+    async def get_blogger(self, account_id: str) -> Optional[DataBlogger]:
+        if self._bloggers_refreshed_at is None:
+            await self._bloggers_refresh.do("bloggers", self.refresh_bloggers)
+        elif time.monotonic() - self._bloggers_refreshed_at > self.bloggers_refresh_interval:
+            # Events keep being processed with the current bloggers while the refresh runs
+            self._bloggers_refresh.start("bloggers", self.refresh_bloggers_in_background)
+        return self._bloggers.get(account_id)
+
+    async def refresh_bloggers_in_background(self) -> None:
+        try:
+            await self.refresh_bloggers()
+            await DirectManager.refresh_pending_answers()
+        except Exception as e:
+            logger.error("Error while refreshing bloggers of webhook events")
+            logger.error(str(e))
+
+    async def refresh_bloggers(self) -> None:
+        """Builds the bloggers map without holding the lock, it is only taken to swap the map in"""
+        bloggers = {}
+        for blogger in await DirectManager.get_active_bloggers():
+            if blogger is None or not blogger.can_use_official_graph_api or not blogger.facebook_page_id:
+                continue
+            bloggers[blogger.facebook_page_id] = blogger
+            instagram_account_id = self._instagram_account_ids.get(blogger.facebook_page_id)
+            if instagram_account_id is None:
+                backend = await DirectManager.get_instagram_backend(blogger)
+                try:
+                    instagram_account_id = await backend.get_instagram_account_id()
+                except Exception as e:
+                    logger.error(f"Error while getting instagram account id. Blogger: {blogger.instagram_login}")
+                    logger.error(str(e))
+                    continue
+                if instagram_account_id:
+                    self._instagram_account_ids[blogger.facebook_page_id] = instagram_account_id
+            if instagram_account_id:
+                bloggers[instagram_account_id] = blogger
+        async with self._bloggers_lock:
+            self._bloggers = bloggers
+            self._bloggers_refreshed_at = time.monotonic()
+
+    async def get_conversation(self, blogger: DataBlogger, event: WebhookEvent) -> Optional[tuple[str, str]]:
+        key = (event.account_id, event.user_id)
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            backend = await DirectManager.get_instagram_backend(blogger)
+            raw_conversation = await backend.get_raw_conversation_by_user(event.user_id)
+            if raw_conversation is None:
+                return None
+            participants = raw_conversation["participants"]["data"]
+            user = next((item for item in participants if item["id"] == event.user_id), participants[-1])
+            conversation = (raw_conversation["id"], user["username"])
+            self._conversations.set(key, conversation)
+        return conversation
+
+
+webhook_processor = WebhookProcessor(WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_BLOGGERS_REFRESH_INTERVAL)
+
+
+@webhook_router.get("/instagram", response_class=PlainTextResponse)
+async def verify_instagram_webhook(request: Request):
+    params = request.query_params
+    if params.get("hub.mode") != "subscribe" or not FACEBOOK_WEBHOOK_VERIFY_TOKEN or not hmac.compare_digest(
+        params.get("hub.verify_token", ""), FACEBOOK_WEBHOOK_VERIFY_TOKEN
+    ):
+        raise APIException(
+            error_code=ErrorCode.webhook_invalid_verify_token,
+            status_code=status.HTTP_403_FORBIDDEN,
+            message="Webhook verify token doesn't match",
+        )
+    return params.get("hub.challenge", "")
+
+
+@webhook_router.post("/instagram")
+async def receive_instagram_webhook(request: Request):
+    body = await request.body()
+    if not is_valid_signature(body, request.headers.get("X-Hub-Signature-256")):
+        webhook_events.inc(result="rejected")
+        raise APIException(
+            error_code=ErrorCode.webhook_invalid_signature,
+            status_code=status.HTTP_403_FORBIDDEN,
+            message="Webhook signature is invalid",
+        )
+
+    try:
+        events = parse_webhook_payload(json.loads(body))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        webhook_events.inc(result="rejected")
+        raise APIException(
+            error_code=ErrorCode.webhook_invalid_payload,
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="Webhook payload is malformed",
+            detail=str(e),
+        )
+    for index, event in enumerate(events):
+        try:
+            webhook_processor.put(event)
+        except asyncio.QueueFull:
+            # Meta redelivers events that weren't acknowledged, the conversations that were queued are idempotent
+            webhook_events.inc(sum(len(item.messages) for item in events[index:]), result="rejected")
+            raise APIException(
+                error_code=ErrorCode.webhook_queue_full,
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                message="Webhook queue is full",
+            )
+        webhook_events.inc(len(event.messages), result="queued")
+    return {"Success": True}
@@ -1,14 +1,23 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Callable, Optional
 
-from instagrapi.types import DirectMessage, DirectThread
+from base.executors import BlockingCallRunner
+
+if TYPE_CHECKING:
+    from instagrapi.types import DirectMessage, DirectThread
 
 
 class BaseDirectBackend(ABC):
+    # Every backend type owns a runner, so blocking calls of one type can't starve the others
+    runner: BlockingCallRunner
+
+    async def run_blocking(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        return await self.runner.run(func, *args, **kwargs)
+
     @abstractmethod
-    async def get_all_threads(self) -> list[Optional[DirectThread]]:
+    async def get_all_threads(self, since: Optional[float] = None) -> list[Optional["DirectThread"]]:
         raise NotImplementedError
 
     @abstractmethod
-    async def send_message(self, message) -> DirectMessage:
+    async def send_message(self, message) -> "DirectMessage":
         raise NotImplementedError
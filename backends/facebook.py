@@ -1,4 +1,6 @@
+import asyncio
 from datetime import datetime
+from typing import Optional
 
 from api.schemas import (
     DataGeneratedMessage,
@@ -6,10 +8,24 @@ from api.schemas import (
     DataThreadRequest,
 )
 from backends.base import BaseDirectBackend
+from base.executors import BlockingCallRunner
+from configs import (
+    FACEBOOK_CONVERSATIONS_PAGE_SIZE,
+    FACEBOOK_MAX_CONCURRENCY,
+    FACEBOOK_MAX_CONVERSATIONS,
+    FACEBOOK_MESSAGES_LIMIT,
+    FACEBOOK_MESSAGES_PAGE_SIZE,
+)
 from pyfacebook import GraphAPI
 
+MESSAGE_FIELDS = "id,message,from,to,created_time"
+# Participants and the first page of messages are expanded into the conversations request
+CONVERSATION_FIELDS = f"id,updated_time,participants,messages.limit({FACEBOOK_MESSAGES_PAGE_SIZE}){{{MESSAGE_FIELDS}}}"
+
 
 class FacebookBackend(BaseDirectBackend):
+    runner = BlockingCallRunner("facebook", FACEBOOK_MAX_CONCURRENCY)
+
     def __init__(self, access_token: str, page_id: str) -> None:
         self.page_id: str = page_id
         self.access_token: str = access_token
@@ -18,25 +34,88 @@ class FacebookBackend(BaseDirectBackend):
     def _get_client(self):
         return GraphAPI(access_token=self.access_token)
 
-    async def get_raw_conversations(self) -> list[dict]:
+    @staticmethod
+    def _parse_time(value: str) -> float:
+        return datetime.fromisoformat(value).timestamp()
+
+    async def get_raw_conversations(self, since: Optional[float] = None) -> list[dict]:
+        """
+        Returns conversations with their participants and first page of messages expanded in the same request.
+        Pages are followed by cursor until FACEBOOK_MAX_CONVERSATIONS is reached or, when `since` is given,
+        until conversations that weren't updated after it (they are ordered by update time).
+
+        Docs for response from Facebook is here:
+        https://developers.facebook.com/docs/graph-api/reference/page/conversations/
+        """
+        conversations = []
+        after = None
+        while True:
+            params = {"platform": "instagram", "fields": CONVERSATION_FIELDS, "limit": FACEBOOK_CONVERSATIONS_PAGE_SIZE}
+            if after:
+                params["after"] = after
+            page = await self.run_blocking(self.client.get_connection, self.page_id, "conversations", **params)
+            data = page.get("data", [])
+            if since is not None:
+                fresh = [item for item in data if self._parse_time(item["updated_time"]) > since]
+                conversations.extend(fresh)
+                if len(fresh) < len(data):
+                    break
+            else:
+                conversations.extend(data)
+
+            paging = page.get("paging", {})
+            after = paging.get("cursors", {}).get("after")
+            if not paging.get("next") or not after or len(conversations) >= FACEBOOK_MAX_CONVERSATIONS:
+                break
+        return conversations[:FACEBOOK_MAX_CONVERSATIONS]
+
+    async def get_instagram_account_id(self) -> Optional[str]:
+        """Returns the id of the Instagram professional account connected to the page"""
+        page = await self.run_blocking(self.client.get_object, self.page_id, fields="instagram_business_account")
+        return page.get("instagram_business_account", {}).get("id")
+
+    async def get_raw_conversation_by_user(self, user_id: str, fields: str = "id,participants") -> Optional[dict]:
         """
+        Returns the conversation of the page with the user, by default only its id and participants.
+
         Docs for response from Facebook is here:
         https://developers.facebook.com/docs/graph-api/reference/page/conversations/
         """
-        conversations = self.client.get_connection(self.page_id, "conversations", platform="instagram")["data"]
-        return conversations
+        page = await self.run_blocking(
+            self.client.get_connection,
+            self.page_id,
+            "conversations",
+            platform="instagram",
+            user_id=user_id,
+            fields=fields,
+        )
+        data = page.get("data", [])
+        return data[0] if data else None
 
-    async def get_all_threads(self) -> list[DataThreadRequest]:
-        raw_conversations = await self.get_raw_conversations()
-        threads = await self.format_raw_conversations_to_threads(raw_conversations)
+    async def get_all_threads(self, since: Optional[float] = None) -> list[DataThreadRequest]:
+        """
+        Returns the page conversations as threads.
+        When `since` is given, only conversations updated after it are returned, each with its new messages only.
+        """
+        raw_conversations = await self.get_raw_conversations(since)
+        threads = await self.format_raw_conversations_to_threads(raw_conversations, since)
         return threads
 
+    async def get_thread_by_user(self, user_id: str) -> Optional[DataThreadRequest]:
+        """Returns the whole conversation of the page with the user as a thread"""
+        raw_conversation = await self.get_raw_conversation_by_user(user_id, fields=CONVERSATION_FIELDS)
+        if raw_conversation is None:
+            return None
+        threads = await self.format_raw_conversations_to_threads([raw_conversation])
+        return threads[0] if threads else None
+
     async def send_message(self, message: DataGeneratedMessage) -> None:
         """
         Docs for response from Facebook is here:
         https://developers.facebook.com/docs/graph-api/reference/page/messages/
         """
-        self.client.post_object(
+        await self.run_blocking(
+            self.client.post_object,
             object_id=self.page_id,
             connection="messages",
             data={
@@ -45,30 +124,51 @@ class FacebookBackend(BaseDirectBackend):
             },
         )
 
-    async def get_raw_messages_by_conversation(self, conversation: dict) -> list[dict]:
+    async def get_raw_messages_by_conversation(self, conversation: dict, since: Optional[float] = None) -> list[dict]:
         """
+        Returns the messages expanded in the conversation and follows their cursor
+        until FACEBOOK_MESSAGES_LIMIT or, when `since` is given, messages that aren't newer than it.
+
         Docs for response from Facebook is here:
         https://developers.facebook.com/docs/graph-api/reference/page/messages/
         """
+        page = conversation.get("messages", {})
         messages = []
-        for raw_message in conversation["messages"]["data"]:
-            message_data = self.client.get(
-                raw_message["id"],
-                {"fields": "id, message, to, created_time, from, thread_id"},
+        while True:
+            data = page.get("data", [])
+            messages.extend(data)
+            if since is not None and data and self._parse_time(data[-1]["created_time"]) <= since:
+                break
+
+            paging = page.get("paging", {})
+            after = paging.get("cursors", {}).get("after")
+            if not paging.get("next") or not after or len(messages) >= FACEBOOK_MESSAGES_LIMIT:
+                break
+            page = await self.run_blocking(
+                self.client.get_connection,
+                conversation["id"],
+                "messages",
+                fields=MESSAGE_FIELDS,
+                limit=FACEBOOK_MESSAGES_PAGE_SIZE,
+                after=after,
             )
-            messages.append(message_data)
-        return messages
+        return messages[:FACEBOOK_MESSAGES_LIMIT]
+
+    async def format_raw_conversations_to_threads(
+        self, raw_conversations: list[dict], since: Optional[float] = None
+    ) -> list[DataThreadRequest]:
+        # Conversations whose messages need more pages are followed concurrently, bounded by the backend runner
+        raw_messages_by_conversation = await asyncio.gather(
+            *(self.get_raw_messages_by_conversation(conversation, since) for conversation in raw_conversations)
+        )
 
-    async def format_raw_conversations_to_threads(self, raw_conversations: list[dict]) -> list[DataThreadRequest]:
         threads = []
-        for raw_conversation in raw_conversations:
-            conversation = self.client.get(
-                raw_conversation["id"],
-                {"fields": "messages, participants, scoped_thread_key"},
+        for conversation, raw_messages in zip(raw_conversations, raw_messages_by_conversation):
+            messages = await self.format_raw_messages(
+                raw_messages, conversation["participants"]["data"][0]["username"], since
             )
-
-            raw_messages = await self.get_raw_messages_by_conversation(conversation)
-            messages = await self.format_raw_messages(raw_messages, conversation["participants"]["data"][0]["username"])
+            if since is not None and not messages:
+                continue
 
             thread = DataThreadRequest(
                 instagram_id_from_official_graph_api=conversation["id"],
@@ -81,16 +181,19 @@ class FacebookBackend(BaseDirectBackend):
 
     @staticmethod
     async def format_raw_messages(
-        raw_messages: list[dict], thread_owner_username: str
+        raw_messages: list[dict], thread_owner_username: str, since: Optional[float] = None
     ) -> list[DataThreadMessageRequest]:
         messages = []
         for raw_message in raw_messages:
-            if not raw_message["message"]:
+            if not raw_message.get("message"):
+                continue
+            created_at = FacebookBackend._parse_time(raw_message["created_time"])
+            if since is not None and created_at <= since:
                 continue
 
             message = DataThreadMessageRequest(
                 instagram_id_from_official_graph_api=raw_message["id"],
-                created_at=datetime.fromisoformat(raw_message["created_time"]).timestamp(),
+                created_at=created_at,
                 sender=("blogger" if raw_message["from"]["username"] == thread_owner_username else "external_user"),
                 instagram_user_id_official_graph_api=raw_message["to"]["data"][0]["id"],
                 item_type="text",
@@ -1,21 +1,48 @@
+import asyncio
 import base64
 import json
 import zlib
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
 
-import aiohttp
 from api.schemas import (
     DataGeneratedMessage,
     DataThreadMessageRequest,
     DataThreadRequest,
 )
 from backends.base import BaseDirectBackend
+from base.cache import LRUCache
+from base.executors import BlockingCallRunner
+from base.http import http_clients
+from base.resilience import retry
+from configs import (
+    INSTAGRAPI_CLIENTS_CACHE_SIZE,
+    INSTAGRAPI_CLIENTS_CACHE_TTL,
+    INSTAGRAPI_MAX_CONCURRENCY,
+    INSTAGRAPI_PENDING_THREADS_LIMIT,
+    INSTAGRAPI_THREAD_MESSAGES_LIMIT,
+    INSTAGRAPI_THREADS_LIMIT,
+)
 from instagrapi import Client
+from instagrapi.exceptions import (
+    ChallengeRequired,
+    LoginRequired,
+    ReloginAttemptExceeded,
+)
 from instagrapi.types import DirectMessage, DirectThread
 from loguru import logger
 
+# Errors after which the cached session can't be trusted anymore
+SESSION_ERRORS = (ChallengeRequired, LoginRequired, ReloginAttemptExceeded)
+
 
 class InstagrapiBackend(BaseDirectBackend):
+    runner = BlockingCallRunner("instagrapi", INSTAGRAPI_MAX_CONCURRENCY)
+    # Ready clients are shared between backend instances, keyed by instagram login
+    clients: LRUCache[str, Client] = LRUCache(maxsize=INSTAGRAPI_CLIENTS_CACHE_SIZE, ttl=INSTAGRAPI_CLIENTS_CACHE_TTL)
+    # Locks of the logins whose clients are in use, with the number of callers holding or waiting for each
+    _clients_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
     def __init__(self, session_url: str, instagram_login: str) -> None:
         self._session_url = session_url
         self.instagram_login = instagram_login
@@ -46,35 +73,115 @@ class InstagrapiBackend(BaseDirectBackend):
     async def _get_client(self) -> Client:
         """
         Retrieves a Client object for the specified Instagram login.
+        The client is taken from the cache if it is there, otherwise it is built from the auth service session.
+        The caller must hold the lock of the login.
 
         Returns:
             Client: The Client object with the specified settings and optional proxy.
 
         """
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self._session_url}/{self.instagram_login}") as response:
-                response.raise_for_status()
-                response = await response.json()
+        client = self.clients.get(self.instagram_login)
+        if client is None:
+            client = await self._create_client()
+            self.clients.set(self.instagram_login, client)
+        return client
+
+    @asynccontextmanager
+    async def _use_client(self) -> AsyncIterator[Client]:
+        """
+        Gives the client of the login to one caller at a time. Instagrapi keeps the last response and the request
+        headers on the client, so overlapping calls could swap or drop each other's results.
+        """
+        login = self.instagram_login
+        lock, users = self._clients_locks.get(login, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._clients_locks[login] = (lock, users + 1)
+        try:
+            async with lock:
+                self.client = await self._get_client()
+                try:
+                    yield self.client
+                except SESSION_ERRORS:
+                    self.invalidate_client()
+                    raise
+        finally:
+            lock, users = self._clients_locks[login]
+            # The lock is dropped once nobody holds or waits for it, so there is no lock per login ever seen
+            if users == 1:
+                del self._clients_locks[login]
+            else:
+                self._clients_locks[login] = (lock, users - 1)
+
+    def invalidate_client(self) -> None:
+        self.clients.pop(self.instagram_login)
+        logger.debug(f"Cached client for instagram login '{self.instagram_login}' was invalidated")
+
+    @retry()
+    async def _create_client(self) -> Client:
+        async with http_clients.auth.get(
+            f"{self._session_url}/{self.instagram_login}", endpoint="/api/v1/session/{instagram_login}"
+        ) as response:
+            response.raise_for_status()
+            response = await response.json()
         session = self._unpack_session(response["session"])
 
         return Client(settings=session, proxy=response.get("proxy"))
 
-    async def get_all_threads(self) -> list[Optional[DataThreadRequest]]:
-        self.client = await self._get_client()
-        raw_threads_from_requests_mailbox = self.client.direct_pending_inbox()
-        raw_threads = self.client.direct_threads()
+    async def get_raw_threads(
+        self, fetch_chunk: Callable, limit: int, since: Optional[float] = None, **kwargs
+    ) -> list[DirectThread]:
+        """
+        Walks an inbox page by page with its cursor, newest threads first.
+        Stops after `limit` threads or at the first thread without activity after `since`.
+        """
+        raw_threads = []
+        cursor = None
+        while len(raw_threads) < limit:
+            chunk, cursor = await self.run_blocking(fetch_chunk, cursor=cursor, **kwargs)
+            if since is not None:
+                fresh_threads = [thread for thread in chunk if thread.last_activity_at.timestamp() > since]
+                raw_threads.extend(fresh_threads)
+                if len(fresh_threads) < len(chunk):
+                    break
+            else:
+                raw_threads.extend(chunk)
+            if not chunk or not cursor:
+                break
+        return raw_threads[:limit]
+
+    async def get_all_threads(self, since: Optional[float] = None) -> list[Optional[DataThreadRequest]]:
+        """
+        Returns threads from the main and then the pending inbox.
+        When `since` is given, only threads with activity after it are returned, each with its new messages only.
+        """
+        async with self._use_client() as client:
+            raw_threads = await self.get_raw_threads(
+                client.direct_threads_chunk,
+                INSTAGRAPI_THREADS_LIMIT,
+                since,
+                thread_message_limit=INSTAGRAPI_THREAD_MESSAGES_LIMIT,
+            )
+            raw_threads_from_requests_mailbox = await self.get_raw_threads(
+                client.direct_pending_chunk, INSTAGRAPI_PENDING_THREADS_LIMIT, since
+            )
 
-        threads = await self.format_raw_threads(raw_threads + raw_threads_from_requests_mailbox)
+        threads = await self.format_raw_threads(raw_threads + raw_threads_from_requests_mailbox, since)
         return threads
 
     async def send_message(self, message: DataGeneratedMessage) -> None:
-        self.client = await self._get_client()
-        self.client.direct_send(text=message.text, thread_ids=[message.thread_instagram_id_from_instagrapi])
+        async with self._use_client() as client:
+            await self.run_blocking(
+                client.direct_send, text=message.text, thread_ids=[message.thread_instagram_id_from_instagrapi]
+            )
 
-    async def format_raw_threads(self, raw_threads: list[DirectThread]) -> list[DataThreadRequest]:
+    async def format_raw_threads(
+        self, raw_threads: list[DirectThread], since: Optional[float] = None
+    ) -> list[DataThreadRequest]:
         threads = []
         for raw_thread in raw_threads:
-            messages = await self.format_raw_messages(raw_thread.messages, raw_thread.users[0].pk)
+            messages = await self.format_raw_messages(raw_thread.messages, raw_thread.users[0].pk, since)
+            if since is not None and not messages:
+                continue
             thread = DataThreadRequest(
                 instagram_id_from_instagrapi=raw_thread.id,
                 thread_to_user_id_from_instagrapi=raw_thread.users[0].pk,
@@ -86,10 +193,12 @@ class InstagrapiBackend(BaseDirectBackend):
 
     @staticmethod
     async def format_raw_messages(
-        raw_messages: list[DirectMessage], recipient_pk: str
+        raw_messages: list[DirectMessage], recipient_pk: str, since: Optional[float] = None
     ) -> list[DataThreadMessageRequest]:
         messages = []
         for raw_message in raw_messages:
+            if since is not None and raw_message.timestamp.timestamp() <= since:
+                continue
             message = DataThreadMessageRequest(
                 instagram_id_from_instagrapi=raw_message.id,
                 created_at=raw_message.timestamp.timestamp(),
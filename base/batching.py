@@ -0,0 +1,86 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Collects items submitted concurrently and processes them with one `handle_batch` call.
+
+    A batch is flushed when it reaches `max_size` items or `max_wait` seconds after its first item.
+    Items are only batched with items of the same group. `handle_batch` must return one result per item
+    in the same order; if it fails, every item of the batch is retried on its own with `handle_single`.
+    """
+
+    def __init__(
+        self,
+        handle_batch: Callable[[list[T]], Awaitable[list[R]]],
+        handle_single: Callable[[T], Awaitable[R]],
+        max_size: int,
+        max_wait: float,
+        name: str = "batcher",
+    ) -> None:
+        self.handle_batch = handle_batch
+        self.handle_single = handle_single
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.name = name
+        self._pending: dict[Hashable, list[tuple[T, asyncio.Future]]] = {}
+        self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item: T, group: Hashable = None) -> R:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+        pending = self._pending.setdefault(group, [])
+        pending.append((item, future))
+
+        if len(pending) >= self.max_size:
+            self._flush(group)
+        elif group not in self._timers:
+            self._timers[group] = loop.call_later(self.max_wait, self._flush, group)
+
+        return await future
+
+    def _flush(self, group: Hashable) -> None:
+        timer: Optional[asyncio.TimerHandle] = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(group, None)
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list[tuple[T, asyncio.Future]]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = await self.handle_batch(items) if len(items) > 1 else None
+            if results is not None and len(results) != len(items):
+                raise ValueError(f"Expected {len(items)} results, got {len(results)}")
+        except Exception as e:
+            logger.error(f"{self.name}: batch of {len(items)} items failed, falling back to single requests")
+            logger.error(str(e))
+            results = None
+
+        if results is not None:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            return
+
+        await asyncio.gather(*(self._run_single(item, future) for item, future in batch))
+
+    async def _run_single(self, item: T, future: asyncio.Future) -> None:
+        try:
+            result: Any = await self.handle_single(item)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
@@ -14,6 +14,14 @@ class ErrorCode(StrEnum):
     sqlalchemy_getting_bloggers_error = "sqlalchemy.getting_bloggers_error"
     ml_service_getting_generated_text = "ml_service.getting_generated_text"
 
+    webhook_invalid_verify_token = "webhook.invalid_verify_token"
+    webhook_invalid_signature = "webhook.invalid_signature"
+    webhook_invalid_payload = "webhook.invalid_payload"
+    webhook_queue_full = "webhook.queue_full"
+
+    direct_job_not_found = "direct.job_not_found"
+    direct_delivery_disabled = "direct.delivery_disabled"
+
 
 class APIException(HTTPException):
     def __init__(
@@ -0,0 +1,55 @@
+import asyncio
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from base.metrics import backend_call_duration
+from configs import BACKEND_EXECUTOR_MAX_WORKERS
+from loguru import logger
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Executor:
+    """
+    Returns the shared thread pool used for blocking backend calls.
+
+    Backend calls run on bound methods of stateful clients (sessions, cookies, rate limits), which can't be moved
+    to worker processes, so there is no process pool.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=BACKEND_EXECUTOR_MAX_WORKERS,
+            thread_name_prefix="direct-backend",
+        )
+        logger.debug(f"Backend executor was created, workers: {BACKEND_EXECUTOR_MAX_WORKERS}")
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class BlockingCallRunner:
+    """Runs synchronous calls of one backend type on the shared pool, capping how many run at the same time."""
+
+    def __init__(self, name: str, max_concurrency: int) -> None:
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            with backend_call_duration.time(backend=self.name, call=getattr(func, "__name__", "call")):
+                return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
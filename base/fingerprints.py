@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+from typing import Optional, Union
+
+from api.schemas import DataThread, DataThreadRequest
+from base.cache import LRUCache
+from base.metrics import thread_fingerprint_lookups
+from configs import THREAD_FINGERPRINTS_CACHE_SIZE, THREAD_FINGERPRINTS_PATH
+from loguru import logger
+
+
+class ThreadFingerprints:
+    """
+    Remembers a hash of the message ids and timestamps of every processed thread, keyed by blogger and thread.
+
+    `filter_changed` drops threads whose hash is the same as last time. The new hash is only remembered
+    by `commit`, once the thread went through saving and generation, so a thread that failed on the way
+    is processed again in the next cycle. The worker loads the stored fingerprints once the path of its shard is known.
+    """
+
+    def __init__(self, maxsize: int, path: Optional[str] = None) -> None:
+        self.path = path
+        self._fingerprints: LRUCache[str, str] = LRUCache(maxsize=maxsize)
+        self._pending: LRUCache[str, str] = LRUCache(maxsize=maxsize)
+        self.unchanged = 0
+        self.changed = 0
+
+    @staticmethod
+    def get_key(blogger_id: int, thread: Union[DataThread, DataThreadRequest]) -> str:
+        thread_id = thread.instagram_id_from_instagrapi or thread.instagram_id_from_official_graph_api
+        return f"{blogger_id}:{thread_id}"
+
+    @staticmethod
+    def compute(thread: DataThreadRequest) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        for message in sorted(thread.messages, key=lambda item: item.created_at):
+            message_id = message.instagram_id_from_instagrapi or message.instagram_id_from_official_graph_api
+            digest.update(f"{message_id}:{message.created_at};".encode())
+        return digest.hexdigest()
+
+    def filter_changed(self, blogger_id: int, threads: list[DataThreadRequest]) -> list[DataThreadRequest]:
+        changed = []
+        for thread in threads:
+            key = self.get_key(blogger_id, thread)
+            fingerprint = self.compute(thread)
+            if self._fingerprints.get(key) == fingerprint:
+                self.unchanged += 1
+                thread_fingerprint_lookups.inc(result="hit")
+                continue
+            self.changed += 1
+            thread_fingerprint_lookups.inc(result="miss")
+            self._pending.set(key, fingerprint)
+            changed.append(thread)
+        return changed
+
+    def commit(self, blogger_id: int, thread: Union[DataThread, DataThreadRequest]) -> None:
+        key = self.get_key(blogger_id, thread)
+        fingerprint = self._pending.pop(key)
+        if fingerprint is not None:
+            self._fingerprints.set(key, fingerprint)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Threads skipped as unchanged and threads passed on by `filter_changed`, like the lookups metric.
+        The cache counters aren't used, a stored fingerprint that differs is a cache hit but a changed thread.
+        """
+        total = self.unchanged + self.changed
+        return {
+            "size": len(self._fingerprints),
+            "unchanged": self.unchanged,
+            "changed": self.changed,
+            "unchanged_rate": round(self.unchanged / total, 3) if total else 0.0,
+        }
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                for key, fingerprint in json.load(file).items():
+                    self._fingerprints.set(key, fingerprint)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load thread fingerprints from '{self.path}'")
+            logger.error(str(e))
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(dict(self._fingerprints.items()), file)
+        os.replace(tmp_path, self.path)
+
+
+thread_fingerprints = ThreadFingerprints(THREAD_FINGERPRINTS_CACHE_SIZE, THREAD_FINGERPRINTS_PATH or None)
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+import aiohttp
+from configs import (
+    AUTH_SERVICE_CONNECTIONS_LIMIT,
+    AUTH_SERVICE_TIMEOUT,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_TIMEOUT,
+    CONSUMER_CONNECTIONS_LIMIT,
+    CONSUMER_TIMEOUT,
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT,
+    ML_SERVICE_CONNECTIONS_LIMIT,
+    ML_SERVICE_TIMEOUT,
+    WRAPPER_SERVICE_CONNECTIONS_LIMIT,
+    WRAPPER_SERVICE_TIMEOUT,
+)
+from base.metrics import upstream_request_duration, upstream_requests
+from base.resilience import CircuitBreaker
+from loguru import logger
+
+
+def _get_trace_config(upstream: str, breaker: CircuitBreaker) -> aiohttp.TraceConfig:
+    """
+    Reports duration and status of every request of the upstream to the metrics registry
+    and its outcome to the upstream circuit breaker.
+    """
+
+    async def on_request_start(_, context: SimpleNamespace, __) -> None:
+        context.started_at = time.perf_counter()
+
+    async def on_request_end(_, context: SimpleNamespace, params: aiohttp.TraceRequestEndParams) -> None:
+        report(context, params.method, params.url.path, str(params.response.status))
+        if params.response.status == 429 or params.response.status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    async def on_request_exception(_, context: SimpleNamespace, params: aiohttp.TraceRequestExceptionParams) -> None:
+        report(context, params.method, params.url.path, params.exception.__class__.__name__)
+        if not isinstance(params.exception, asyncio.CancelledError):
+            breaker.record_failure()
+
+    def report(context: SimpleNamespace, method: str, path: str, status: str) -> None:
+        endpoint = getattr(context.trace_request_ctx, "endpoint", None) or path
+        upstream_request_duration.observe(
+            time.perf_counter() - context.started_at, upstream=upstream, method=method, endpoint=endpoint
+        )
+        upstream_requests.inc(upstream=upstream, method=method, endpoint=endpoint, status=status)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+class UpstreamClient:
+    """
+    Long-lived aiohttp session for a single upstream service.
+
+    The session is created lazily on first use, so it is always bound to the running event loop,
+    and is reused for every request to that upstream until `close` is called.
+    While the circuit breaker of the upstream is open, requests fail right away with CircuitOpenError.
+    """
+
+    def __init__(self, name: str, connections_limit: int, timeout: float) -> None:
+        self.name = name
+        self._connections_limit = connections_limit
+        self._timeout = timeout
+        self.breaker = CircuitBreaker(name, CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_TIMEOUT)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self.open()
+
+    def open(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._connections_limit,
+                limit_per_host=self._connections_limit,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+                trace_configs=[_get_trace_config(self.name, self.breaker)],
+            )
+            logger.debug(f"HTTP session for upstream '{self.name}' was created")
+        return self._session
+
+    # `endpoint` replaces the url path in metrics, for urls containing ids
+    def get(self, url: str, endpoint: Optional[str] = None, **kwargs):
+        self.breaker.check()
+        return self.session.get(url, trace_request_ctx=SimpleNamespace(endpoint=endpoint), **kwargs)
+
+    def post(self, url: str, endpoint: Optional[str] = None, **kwargs):
+        self.breaker.check()
+        return self.session.post(url, trace_request_ctx=SimpleNamespace(endpoint=endpoint), **kwargs)
+
+    def patch(self, url: str, endpoint: Optional[str] = None, **kwargs):
+        self.breaker.check()
+        return self.session.patch(url, trace_request_ctx=SimpleNamespace(endpoint=endpoint), **kwargs)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.debug(f"HTTP session for upstream '{self.name}' was closed")
+        self._session = None
+
+
+class HTTPClients:
+    """Registry of the shared upstream clients used by the publisher, the consumer and the API app."""
+
+    def __init__(self) -> None:
+        self.wrapper = UpstreamClient("wrapper", WRAPPER_SERVICE_CONNECTIONS_LIMIT, WRAPPER_SERVICE_TIMEOUT)
+        self.ml = UpstreamClient("ml", ML_SERVICE_CONNECTIONS_LIMIT, ML_SERVICE_TIMEOUT)
+        self.auth = UpstreamClient("auth", AUTH_SERVICE_CONNECTIONS_LIMIT, AUTH_SERVICE_TIMEOUT)
+        # Consumer workers, signalled by the API app to deliver right away
+        self.consumer = UpstreamClient("consumer", CONSUMER_CONNECTIONS_LIMIT, CONSUMER_TIMEOUT)
+
+    @property
+    def upstreams(self) -> list[UpstreamClient]:
+        return [self.wrapper, self.ml, self.auth, self.consumer]
+
+    async def start(self) -> None:
+        for upstream in self.upstreams:
+            upstream.open()
+
+    async def close(self) -> None:
+        await asyncio.gather(*(upstream.close() for upstream in self.upstreams))
+
+
+http_clients = HTTPClients()
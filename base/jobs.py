@@ -0,0 +1,82 @@
+import asyncio
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from base.cache import LRUCache
+from loguru import logger
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: str = "running"
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class JobRegistry:
+    """
+    Runs calls in the background and keeps their handles, finished jobs are kept for `ttl` seconds.
+
+    Like SingleFlight, a call started with the key of an in-flight job doesn't start another run
+    and gets the handle of the in-flight job instead.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None) -> None:
+        self._jobs: LRUCache[str, Job] = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight: dict[Hashable, Job] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def start(self, kind: str, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Job:
+        job = self._in_flight.get(key)
+        if job is not None:
+            logger.debug(f"Job '{kind}' for {key} is already running: {job.id}")
+            return job
+
+        job = Job(id=uuid.uuid4().hex, kind=kind)
+        self._jobs.set(job.id, job)
+        self._in_flight[key] = job
+        task = asyncio.create_task(self._run(job, func))
+        self._tasks.add(task)
+        task.add_done_callback(lambda _: self._finish(key, job, task))
+        return job
+
+    def _finish(self, key: Hashable, job: Job, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._in_flight.pop(key, None)
+        # A task cancelled before it started never ran `_run`
+        if task.cancelled():
+            job.status = "cancelled"
+            job.finished_at = job.finished_at or time.time()
+
+    @staticmethod
+    async def _run(job: Job, func: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            job.result = await func()
+            job.status = "succeeded"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e) or e.__class__.__name__
+            logger.error(f"Job '{job.kind}' {job.id} failed")
+            logger.error(str(e))
+        finally:
+            job.finished_at = time.time()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
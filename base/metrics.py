@@ -0,0 +1,216 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from aiohttp import web
+from loguru import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    values = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return f"{{{values}}}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        super().__init__(name, documentation)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(key))} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, value: float = 1, **labels) -> None:
+        self.inc(-value, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    @contextmanager
+    def track_in_progress(self, **labels) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (counts per bucket, sum, count)
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            item = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                item[0][index] += 1
+            item[1] += value
+            item[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total, count) in list(self._values.items()):
+            labels = dict(key)
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bucket})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+upstream_request_duration = registry.histogram(
+    "direct_upstream_request_duration_seconds", "Duration of HTTP requests to upstream services"
+)
+upstream_requests = registry.counter("direct_upstream_requests_total", "HTTP requests to upstream services")
+backend_call_duration = registry.histogram(
+    "direct_backend_call_duration_seconds", "Duration of blocking Instagram backend calls"
+)
+threads_fetched = registry.counter("direct_threads_fetched_total", "Threads fetched from Instagram")
+threads_saved = registry.counter("direct_threads_saved_total", "Threads saved to the wrapper")
+thread_fingerprint_lookups = registry.counter(
+    "direct_thread_fingerprint_lookups_total", "Lookups of thread fingerprints by result (hit means unchanged)"
+)
+ml_answer_cache_lookups = registry.counter(
+    "direct_ml_answer_cache_lookups_total", "Lookups of generated answers in the cache by result"
+)
+ml_generations = registry.counter("direct_ml_generations_total", "Answers generated by the ML service")
+ml_generations_avoided = registry.counter(
+    "direct_ml_generations_avoided_total", "ML generations skipped because the thread already has an unsent answer"
+)
+messages_sent = registry.counter("direct_messages_sent_total", "Generated messages sent to Instagram")
+messages_failed = registry.counter("direct_messages_failed_total", "Generated messages that failed to send")
+status_updates_rejected = registry.counter(
+    "direct_status_updates_rejected_total", "Message status updates the wrapper rejected, dropped from the buffer"
+)
+webhook_events = registry.counter("direct_webhook_events_total", "Instagram webhook message events by result")
+upstream_retries = registry.counter("direct_upstream_retries_total", "Retries of idempotent upstream calls")
+circuit_breaker_transitions = registry.counter(
+    "direct_circuit_breaker_transitions_total", "State changes of circuit breakers by breaker and new state"
+)
+cycle_peak_tasks = registry.gauge("direct_cycle_peak_tasks", "Peak number of asyncio tasks during the last cycle")
+cycle_peak_rss = registry.gauge("direct_cycle_peak_rss_bytes", "Peak resident memory during the last cycle")
+tasks_in_progress = registry.gauge("direct_tasks_in_progress", "Tasks currently being processed")
+
+
+class MetricsServer:
+    """
+    Minimal HTTP server exposing the registry on /metrics for the worker processes,
+    workers can add their own control routes to it.
+    """
+
+    def __init__(self, port: int, host: str = "0.0.0.0", routes: Optional[list[web.RouteDef]] = None) -> None:
+        self.port = port
+        self.host = host
+        self.routes = routes or []
+        self._runner = None
+
+    async def start(self) -> None:
+        async def metrics(_: web.Request) -> web.Response:
+            return web.Response(text=registry.render(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+        app.router.add_routes(self.routes)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.debug(f"Metrics are served on port {self.port}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def start_metrics_server(
+    port: Optional[int], routes: Optional[list[web.RouteDef]] = None
+) -> Optional[MetricsServer]:
+    if not port:
+        return None
+    server = MetricsServer(port, routes=routes)
+    await server.start()
+    return server
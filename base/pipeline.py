@@ -0,0 +1,189 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, Optional, Union
+
+from base.metrics import tasks_in_progress
+from loguru import logger
+
+# Max handler durations kept per stage for percentiles, sampled uniformly once exceeded
+LATENCY_SAMPLES = 10000
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    processed: int = 0
+    failed: int = 0
+    dropped: int = 0
+    emitted: int = 0
+    busy_time: float = 0.0
+    max_queue_depth: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+    latencies: list[float] = field(default_factory=list, repr=False)
+    _latencies_seen: int = field(default=0, repr=False)
+
+    def observe(self, duration: float) -> None:
+        self._latencies_seen += 1
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(duration)
+        else:
+            index = random.randrange(self._latencies_seen)
+            if index < LATENCY_SAMPLES:
+                self.latencies[index] = duration
+
+    def latency(self, quantile: float) -> float:
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(quantile * len(latencies)))]
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Processed items per second since the pipeline started"""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "emitted": self.emitted,
+            "busy_time": round(self.busy_time, 3),
+            "max_queue_depth": self.max_queue_depth,
+            "throughput": round(self.throughput, 3),
+            "latency_p50": round(self.latency(0.5), 4),
+            "latency_p99": round(self.latency(0.99), 4),
+        }
+
+
+class Stage:
+    """
+    One step of a `Pipeline`.
+
+    `handler` gets one item and returns the item for the next stage, or None to drop it.
+    With `fan_out=True` it returns an iterable and every element is passed on separately.
+    An exception raised by the handler fails only the item it was processing.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[Any]],
+        workers: int = 1,
+        queue_size: int = 100,
+        fan_out: bool = False,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.fan_out = fan_out
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages connected by bounded queues.
+
+    Every stage has its own workers, so an item moves on as soon as its stage is done with it,
+    and a full queue makes the previous stage wait instead of piling up items in memory.
+    """
+
+    def __init__(self, stages: list[Stage], name: str = "pipeline") -> None:
+        self.stages = stages
+        self.name = name
+        self.stats: list[StageStats] = []
+        self._queues: list[asyncio.Queue] = []
+
+    async def run(self, source: Union[Iterable, AsyncIterable]) -> list[StageStats]:
+        self._queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        self.stats = [StageStats(name=stage.name, workers=stage.workers) for stage in self.stages]
+        workers = [
+            [asyncio.create_task(self._worker(index)) for _ in range(stage.workers)]
+            for index, stage in enumerate(self.stages)
+        ]
+
+        try:
+            await self._feed(source)
+            # A stage is finished once its queue is drained and all its workers forwarded their results
+            for index, stage_workers in enumerate(workers):
+                await self._queues[index].join()
+                for worker in stage_workers:
+                    worker.cancel()
+                await asyncio.gather(*stage_workers, return_exceptions=True)
+                self.stats[index].finished_at = time.monotonic()
+        finally:
+            for stage_workers in workers:
+                for worker in stage_workers:
+                    worker.cancel()
+
+        return self.stats
+
+    async def _feed(self, source: Union[Iterable, AsyncIterable]) -> None:
+        if isinstance(source, AsyncIterable):
+            async for item in source:
+                await self._put(0, item)
+        else:
+            for item in source:
+                await self._put(0, item)
+
+    async def _put(self, index: int, item: Any) -> None:
+        queue = self._queues[index]
+        await queue.put(item)
+        stats = self.stats[index]
+        stats.max_queue_depth = max(stats.max_queue_depth, queue.qsize())
+
+    async def _worker(self, index: int) -> None:
+        stage = self.stages[index]
+        stats = self.stats[index]
+        queue = self._queues[index]
+        is_last = index == len(self.stages) - 1
+
+        while True:
+            item = await queue.get()
+            started_at = time.monotonic()
+            try:
+                result = await self._handle(stage, stats, item)
+            except Exception as e:
+                stats.failed += 1
+                logger.error(f"{self.name}: stage '{stage.name}' failed to process an item")
+                logger.error(str(e))
+                continue
+            else:
+                stats.processed += 1
+                if result is None:
+                    stats.dropped += 1
+                    continue
+                results = result if stage.fan_out else [result]
+                for result in results:
+                    stats.emitted += 1
+                    if not is_last:
+                        await self._put(index + 1, result)
+            finally:
+                stats.busy_time += time.monotonic() - started_at
+                queue.task_done()
+
+    @staticmethod
+    async def _handle(stage: Stage, stats: StageStats, item: Any) -> Any:
+        started_at = time.monotonic()
+        try:
+            with tasks_in_progress.track_in_progress(stage=stage.name):
+                return await stage.handler(item)
+        finally:
+            stats.observe(time.monotonic() - started_at)
+
+    def queue_depths(self) -> dict[str, int]:
+        return {stage.name: queue.qsize() for stage, queue in zip(self.stages, self._queues)}
+
+    def log_stats(self) -> None:
+        for stats in self.stats:
+            logger.info(f"{self.name}: {stats.as_dict()}")
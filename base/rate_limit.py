@@ -0,0 +1,37 @@
+import asyncio
+import random
+import time
+
+
+class TokenBucket:
+    """
+    Allows on average `rate` acquisitions per second with bursts of up to `capacity`.
+
+    `jitter` is an extra (min, max) pause in seconds after every acquisition, so the calls don't look periodic.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1, jitter: tuple[float, float] = (0, 0)) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.jitter = jitter
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+    async def pause(self) -> None:
+        low, high = self.jitter
+        if high > 0:
+            await asyncio.sleep(random.uniform(low, high))
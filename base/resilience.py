@@ -0,0 +1,153 @@
+import asyncio
+import functools
+import random
+import time
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+
+from aiohttp import ClientConnectionError, ClientError, ClientResponseError
+from base.metrics import circuit_breaker_transitions, upstream_retries
+from configs import RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from loguru import logger
+
+R = TypeVar("R")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Circuit breaker '{name}' is open, retry after {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+# Errors of upstream calls that a worker loop outlives, also once the retries gave up or for calls without retries.
+# ValueError covers malformed responses, e.g. a streamed list that was cut off
+UPSTREAM_ERRORS = (ClientError, asyncio.TimeoutError, CircuitOpenError, ValueError)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency after `failure_threshold` failures in a row.
+
+    While open, calls fail right away with CircuitOpenError. After `reset_timeout` seconds one trial call
+    is let through (half open): its success closes the breaker, its failure opens it again.
+    Can be used as a context manager around the call or fed with `record_success` / `record_failure`.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at: Optional[float] = None
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            circuit_breaker_transitions.inc(breaker=self.name, state=state)
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+        # A single trial call at a time, a trial that never reported back is replaced after the reset timeout
+        if self._trial_started_at is not None and now - self._trial_started_at < self.reset_timeout:
+            return False
+        self._trial_started_at = now
+        return True
+
+    def check(self) -> None:
+        if not self.allow():
+            retry_after = max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+            raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._trial_started_at = None
+        self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_started_at = None
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            if self.state != OPEN:
+                logger.error(f"Circuit breaker '{self.name}' was opened after {self.failures} failures")
+            self._set_state(OPEN)
+
+    def __enter__(self) -> "CircuitBreaker":
+        self.check()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.record_success()
+        # An open breaker of another dependency inside the call says nothing about this one
+        elif not issubclass(exc_type, (asyncio.CancelledError, CircuitOpenError)):
+            self.record_failure()
+
+
+class CircuitBreakers:
+    """Breakers created on first use by key, e.g. one per Instagram account"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: dict[Hashable, CircuitBreaker] = {}
+
+    def get(self, key: Hashable) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(self.name, self.failure_threshold, self.reset_timeout)
+        return breaker
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Connection errors, timeouts, 429 and 5xx responses are worth another try, anything else isn't"""
+    if isinstance(exc, ClientResponseError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, (ClientConnectionError, asyncio.TimeoutError))
+
+
+def get_backoff_delay(attempt: int, base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY) -> float:
+    """Exponential delay with full jitter, so the retries of many tasks don't hit the upstream together"""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+async def call_with_retry(func: Callable[[], Awaitable[R]], name: str, attempts: int = RETRY_ATTEMPTS) -> R:
+    for attempt in range(attempts):
+        try:
+            return await func()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            delay = get_backoff_delay(attempt)
+            upstream_retries.inc(operation=name)
+            logger.debug(f"Retrying '{name}' in {delay:.2f}s after error: {e!r}")
+            await asyncio.sleep(delay)
+
+
+def retry(attempts: int = RETRY_ATTEMPTS) -> Callable:
+    """
+    Retries the decorated coroutine function on retryable errors with jittered exponential backoff.
+    Only for idempotent calls: sending a message must never be retried.
+    """
+
+    def decorator(func: Callable[..., Awaitable[R]]) -> Callable[..., Awaitable[R]]:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> R:
+            return await call_with_retry(lambda: func(*args, **kwargs), func.__name__, attempts)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import resource
+import sys
+from typing import Optional
+
+from base.metrics import cycle_peak_rss, cycle_peak_tasks
+from loguru import logger
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def get_peak_rss_mb() -> float:
+    """Peak RSS of the whole process lifetime"""
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def get_rss_mb() -> float:
+    """Current RSS, falls back to the lifetime peak where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as file:
+            return round(int(file.read().split()[1]) * _PAGE_SIZE / (1024 * 1024), 1)
+    except (OSError, IndexError, ValueError):
+        return get_peak_rss_mb()
+
+
+class ResourceMonitor:
+    """
+    Samples the number of asyncio tasks and the RSS every `interval` seconds while a cycle runs.
+
+        async with ResourceMonitor("publisher") as monitor:
+            await pipeline.run(bloggers)
+        logger.info(monitor.as_dict())
+
+    The peaks are also exported as gauges labelled by `name`.
+    """
+
+    def __init__(self, name: str, interval: float = 0.1) -> None:
+        self.name = name
+        self.interval = interval
+        self.peak_tasks = 0
+        self.peak_rss_mb = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> None:
+        self.peak_tasks = max(self.peak_tasks, len(asyncio.all_tasks()))
+        self.peak_rss_mb = max(self.peak_rss_mb, get_rss_mb())
+
+    async def _run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> "ResourceMonitor":
+        self.peak_tasks = 0
+        self.peak_rss_mb = 0.0
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.sample()
+        cycle_peak_tasks.set(self.peak_tasks, worker=self.name)
+        cycle_peak_rss.set(self.peak_rss_mb * 1024 * 1024, worker=self.name)
+
+    def as_dict(self) -> dict:
+        return {"peak_tasks": self.peak_tasks, "peak_rss_mb": self.peak_rss_mb}
+
+    def log(self) -> None:
+        logger.info(f"{self.name} cycle resources: {self.as_dict()}")
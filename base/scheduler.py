@@ -0,0 +1,104 @@
+import heapq
+import time
+from dataclasses import dataclass
+from typing import Hashable, Iterable, Optional
+
+
+@dataclass
+class PollState:
+    interval: float
+    due_at: float
+    min_interval: float
+    in_progress: bool = False
+
+
+class AdaptivePollScheduler:
+    """
+    Priority queue of keys (bloggers) ordered by their next poll time.
+
+    After a poll with activity the key is polled again after `min_interval`, after an idle poll
+    its interval grows by `backoff_factor` up to `max_interval`. A key can be added with its own min interval,
+    which also raises its cap when it is above `max_interval`.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, backoff_factor: float = 2) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self._states: dict[Hashable, PollState] = {}
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._counter = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._states
+
+    def _push(self, key: Hashable, state: PollState) -> None:
+        # The counter keeps the heap from comparing keys; entries whose due time changed are skipped on pop
+        self._counter += 1
+        heapq.heappush(self._heap, (state.due_at, self._counter, key))
+
+    def add(self, key: Hashable, min_interval: Optional[float] = None) -> None:
+        """Adds a key that is due right away, keys that are already scheduled only get the new min interval"""
+        min_interval = min_interval or self.min_interval
+        state = self._states.get(key)
+        if state is not None:
+            state.min_interval = min_interval
+            return
+        state = PollState(interval=min_interval, due_at=time.monotonic(), min_interval=min_interval)
+        self._states[key] = state
+        self._push(key, state)
+
+    def retain(self, keys: Iterable[Hashable]) -> None:
+        keys = set(keys)
+        for key in list(self._states):
+            if key not in keys:
+                del self._states[key]
+
+    def pop_due(self, limit: Optional[int] = None) -> list[Hashable]:
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            due_at, _, key = heapq.heappop(self._heap)
+            state = self._states.get(key)
+            if state is None or state.in_progress or state.due_at != due_at:
+                continue
+            state.in_progress = True
+            due.append(key)
+        return due
+
+    def take(self, key: Hashable) -> bool:
+        """Takes a single key like `pop_due` would, returns False if it isn't due"""
+        state = self._states.get(key)
+        if state is None or state.in_progress or state.due_at > time.monotonic():
+            return False
+        state.in_progress = True
+        return True
+
+    def record(self, key: Hashable, active: bool) -> float:
+        """Schedules the next poll of the key after a poll, returns the new interval"""
+        state = self._states.get(key)
+        if state is None:
+            return 0
+        if active:
+            state.interval = state.min_interval
+        else:
+            max_interval = max(self.max_interval, state.min_interval)
+            state.interval = min(max(state.interval, state.min_interval) * self.backoff_factor, max_interval)
+        state.due_at = time.monotonic() + state.interval
+        state.in_progress = False
+        self._push(key, state)
+        return state.interval
+
+    def next_due_in(self) -> Optional[float]:
+        """Seconds until the next key is due, None if nothing is scheduled"""
+        while self._heap:
+            due_at, _, key = self._heap[0]
+            state = self._states.get(key)
+            if state is None or state.in_progress or state.due_at != due_at:
+                heapq.heappop(self._heap)
+                continue
+            return max(0.0, due_at - time.monotonic())
+        return None
@@ -0,0 +1,17 @@
+from configs import SENTRY_DSN, SENTRY_PROFILES_SAMPLE_RATE, SENTRY_TRACES_SAMPLE_RATE
+
+
+def init_sentry() -> None:
+    """Initializes Sentry, the SDK isn't even imported when no DSN is configured"""
+    if not SENTRY_DSN:
+        return
+
+    import sentry_sdk
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        # Share of transactions captured for performance monitoring.
+        traces_sample_rate=SENTRY_TRACES_SAMPLE_RATE,
+        # Share of sampled transactions that are profiled.
+        profiles_sample_rate=SENTRY_PROFILES_SAMPLE_RATE,
+    )
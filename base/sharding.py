@@ -0,0 +1,73 @@
+import argparse
+import glob
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from configs import SHARD_COUNT, SHARD_INDEX
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    Part of the bloggers handled by one worker process.
+
+    Bloggers are assigned by rendezvous hashing of their id, so every blogger belongs to exactly one shard
+    and changing the shard count only moves the bloggers of the added or removed shards.
+    """
+
+    index: int = 0
+    count: int = 1
+
+    def __post_init__(self) -> None:
+        if self.count < 1 or not 0 <= self.index < self.count:
+            raise ValueError(f"Shard index must be in [0, {self.count}), got {self.index}")
+
+    @staticmethod
+    def _weight(blogger_id: int, index: int) -> int:
+        digest = hashlib.blake2b(f"{blogger_id}:{index}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def get_owner(self, blogger_id: int) -> int:
+        return max(range(self.count), key=lambda index: self._weight(blogger_id, index))
+
+    def owns(self, blogger_id: int) -> bool:
+        return self.count == 1 or self.get_owner(blogger_id) == self.index
+
+    def get_path(self, path: Optional[str]) -> Optional[str]:
+        """Per-shard name of a local state file, so shards running on one host don't overwrite each other"""
+        if not path or self.count == 1:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.shard-{self.index}{ext}"
+
+    def get_orphaned_paths(self, path: Optional[str]) -> list[str]:
+        """
+        Existing local state files of shards that aren't part of the current shard count,
+        they are left behind when the shard count changes.
+        """
+        if not path:
+            return []
+        root, ext = os.path.splitext(path)
+        current_paths = {Shard(index, self.count).get_path(path) for index in range(self.count)}
+        paths = [path] + [
+            item
+            for item in glob.glob(f"{glob.escape(root)}.shard-*{glob.escape(ext)}")
+            if item[len(root) + len(".shard-") : len(item) - len(ext)].isdigit()
+        ]
+        return sorted(item for item in paths if item not in current_paths and os.path.exists(item))
+
+    def __str__(self) -> str:
+        return f"{self.index + 1}/{self.count}"
+
+
+def parse_shard_args(description: str) -> Shard:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--shard-index", type=int, default=SHARD_INDEX, help="Index of this worker's shard")
+    parser.add_argument("--shard-count", type=int, default=SHARD_COUNT, help="Number of worker shards")
+    args = parser.parse_args()
+    try:
+        return Shard(args.shard_index, args.shard_count)
+    except ValueError as e:
+        parser.error(str(e))
@@ -0,0 +1,33 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+
+R = TypeVar("R")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the call,
+    the others wait for its result instead of starting their own.
+    A caller that is cancelled doesn't cancel the shared call.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    def get(self, key: Hashable) -> Optional[asyncio.Task]:
+        return self._calls.get(key)
+
+    def start(self, key: Hashable, func: Callable[[], Awaitable[R]]) -> asyncio.Task:
+        """Returns the in-flight call for the key, starting a new one if there is none"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return task
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[R]]) -> R:
+        return await asyncio.shield(self.start(key, func))
+
+    def __len__(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import ClientResponseError
+from api.schemas import GeneratedMessageStatusUpdate
+from base.metrics import status_updates_rejected
+from base.resilience import is_retryable
+from loguru import logger
+
+# Status codes meaning that the wrapper has no bulk endpoint
+BULK_UNSUPPORTED_STATUSES = (404, 405)
+
+
+def is_rejected(exc: BaseException) -> bool:
+    """4xx responses that won't change on a retry, e.g. a 400 or 422 for an invalid update"""
+    return isinstance(exc, ClientResponseError) and 400 <= exc.status < 500 and not is_retryable(exc)
+
+
+class StatusUpdateBuffer:
+    """
+    Write-behind buffer for statuses of generated messages.
+
+    Updates are stored in a local SQLite database first and are sent to the wrapper in bulk,
+    when `max_size` updates are pending or every `flush_interval` seconds. Updates that couldn't be sent stay
+    in the store and are retried on the next flush, also after a restart. If the wrapper has no bulk endpoint
+    or rejects a bulk, updates are sent one by one, and an update the wrapper rejects on its own is dropped.
+    """
+
+    def __init__(
+        self,
+        send_bulk: Callable[[list[GeneratedMessageStatusUpdate]], Awaitable[None]],
+        send_single: Callable[[GeneratedMessageStatusUpdate], Awaitable[object]],
+        path: str = ":memory:",
+        max_size: int = 50,
+        flush_interval: float = 5,
+    ) -> None:
+        self.send_bulk = send_bulk
+        self.send_single = send_single
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.bulk_supported = True
+        self._connection = sqlite3.connect(path or ":memory:")
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS status_updates ("
+            "id INTEGER PRIMARY KEY, status TEXT NOT NULL, error TEXT, created_at REAL NOT NULL)"
+        )
+        self._connection.commit()
+        self._flush_lock = asyncio.Lock()
+        self._failed_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM status_updates").fetchone()[0]
+
+    def pending_ids(self) -> set[int]:
+        """Ids of messages whose status is not in the wrapper yet, they must not be delivered again"""
+        return {row[0] for row in self._connection.execute("SELECT id FROM status_updates")}
+
+    async def add(self, update: GeneratedMessageStatusUpdate) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO status_updates (id, status, error, created_at) VALUES (?, ?, ?, ?)",
+            (update.id, update.status, update.error, time.time()),
+        )
+        self._connection.commit()
+        # After a failed flush the next attempt is left to the periodic flush, so an outage isn't hit on every add
+        recently_failed = self._failed_at is not None and time.monotonic() - self._failed_at < self.flush_interval
+        if len(self) >= self.max_size and not recently_failed and not self._flush_lock.locked():
+            await self.flush()
+
+    def merge(self, path: str) -> int:
+        """
+        Moves the updates of another store into this one and deletes its file, e.g. the store of a shard
+        that no longer exists after the shard count changed. The newer update of a message wins.
+        Raises sqlite3.OperationalError while the consumer of the store is still running and holds its lock.
+        """
+        # Opened read-write without creating it, another shard may have merged and removed it already
+        connection = sqlite3.connect(f"file:{path}?mode=rw", uri=True, timeout=0, isolation_level=None)
+        try:
+            # Every connection to a WAL database holds a shared lock on it until it is closed,
+            # so the exclusive lock is only granted once the consumer of the store stopped
+            connection.execute("PRAGMA locking_mode=EXCLUSIVE")
+            connection.execute("BEGIN EXCLUSIVE")
+            rows = connection.execute("SELECT id, status, error, created_at FROM status_updates").fetchall()
+            self._connection.executemany(
+                "INSERT INTO status_updates (id, status, error, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET status = excluded.status, error = excluded.error, "
+                "created_at = excluded.created_at WHERE excluded.created_at > status_updates.created_at",
+                rows,
+            )
+            self._connection.commit()
+            # Deleted before the lock is released, so no other consumer merges the same updates again
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        finally:
+            connection.close()
+        return len(rows)
+
+    def _pending(self) -> list[GeneratedMessageStatusUpdate]:
+        rows = self._connection.execute("SELECT id, status, error FROM status_updates ORDER BY created_at")
+        return [GeneratedMessageStatusUpdate(id=id_, status=status, error=error) for id_, status, error in rows]
+
+    def _remove(self, updates: list[GeneratedMessageStatusUpdate]) -> None:
+        self._connection.executemany(
+            "DELETE FROM status_updates WHERE id = ? AND status = ?",
+            [(update.id, update.status) for update in updates],
+        )
+        self._connection.commit()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            updates = self._pending()
+            if not updates:
+                return
+
+            if self.bulk_supported:
+                try:
+                    await self.send_bulk(updates)
+                except Exception as e:
+                    if not is_rejected(e):
+                        logger.error(f"Failed to flush {len(updates)} message statuses")
+                        logger.error(str(e))
+                        self._failed_at = time.monotonic()
+                        return
+                    if e.status in BULK_UNSUPPORTED_STATUSES:
+                        logger.debug("Wrapper has no bulk endpoint for message statuses, sending them one by one")
+                        self.bulk_supported = False
+                    else:
+                        # One invalid update rejects the whole bulk, sending them one by one finds it
+                        logger.error(f"Wrapper rejected {len(updates)} message statuses, sending them one by one")
+                        logger.error(str(e))
+                else:
+                    self._failed_at = None
+                    self._remove(updates)
+                    logger.debug(f"{len(updates)} message statuses were flushed")
+                    return
+
+            done = []
+            for update in updates:
+                try:
+                    await self.send_single(update)
+                except Exception as e:
+                    if is_rejected(e):
+                        # Kept in the buffer it would be retried forever and hold back the redelivery of its message
+                        status_updates_rejected.inc(status=e.status)
+                        logger.error(
+                            f"Status '{update.status}' of message with id '{update.id}' was rejected and dropped"
+                        )
+                        logger.error(str(e))
+                        done.append(update)
+                        continue
+                    logger.error(f"Failed to update status of message with id '{update.id}'")
+                    logger.error(str(e))
+                    continue
+                done.append(update)
+            self._remove(done)
+            self._failed_at = None if len(done) == len(updates) else time.monotonic()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to flush message statuses")
+                logger.error(str(e))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        finally:
+            self._connection.close()
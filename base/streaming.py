@@ -0,0 +1,107 @@
+import codecs
+import json
+from typing import TYPE_CHECKING, Any, AsyncIterable, AsyncIterator, Iterable, TypeVar, Union
+
+if TYPE_CHECKING:
+    from aiohttp import StreamReader
+
+T = TypeVar("T")
+
+_WHITESPACE = " \t\n\r"
+# Characters that can follow a complete number
+_NUMBER_END = _WHITESPACE + ",]}"
+_decoder = json.JSONDecoder()
+
+
+async def aiterate(source: Union[Iterable[T], AsyncIterable[T]]) -> AsyncIterator[T]:
+    if isinstance(source, AsyncIterable):
+        async for item in source:
+            yield item
+    else:
+        for item in source:
+            yield item
+
+
+class _JSONStream:
+    """Text buffer over a byte stream, read further on demand while values are decoded from it"""
+
+    def __init__(self, content: "StreamReader", chunk_size: int) -> None:
+        self.content = content
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    async def read_more(self) -> None:
+        if self.eof:
+            raise ValueError("Unexpected end of JSON stream")
+        chunk = await self.content.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        # Already decoded text is dropped, so the buffer only holds the value being decoded
+        self.buffer = self.buffer[self.position :] + self._decoder.decode(chunk, final=self.eof)
+        self.position = 0
+
+    async def peek(self) -> str:
+        """Skips whitespace and returns the next character"""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            await self.read_more()
+
+    async def expect(self, char: str) -> None:
+        if await self.peek() != char:
+            raise ValueError(f"Expected '{char}' at position {self.position} of JSON stream")
+        self.position += 1
+
+    async def decode(self) -> Any:
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                await self.read_more()
+                continue
+            # A number is only complete once a delimiter follows it, "12" of "12.5" or "1" of "1e3" is decoded too
+            if (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and (end == len(self.buffer) or self.buffer[end] not in _NUMBER_END)
+                and not self.eof
+            ):
+                await self.read_more()
+                continue
+            self.position = end
+            return value
+
+
+async def iter_json_array(content: "StreamReader", key: str = "data", chunk_size: int = 65536) -> AsyncIterator[Any]:
+    """
+    Yields the elements of the `key` array of a JSON object body as soon as each of them is received,
+    so neither the whole body nor all the elements have to be held in memory. Other keys are skipped.
+    """
+    stream = _JSONStream(content, chunk_size)
+    await stream.expect("{")
+    if await stream.peek() == "}":
+        return
+    while True:
+        name = await stream.decode()
+        await stream.expect(":")
+        if name == key and await stream.peek() == "[":
+            stream.position += 1
+            if await stream.peek() == "]":
+                return
+            while True:
+                yield await stream.decode()
+                if await stream.peek() == "]":
+                    return
+                await stream.expect(",")
+        await stream.decode()
+        if await stream.peek() == "}":
+            return
+        await stream.expect(",")
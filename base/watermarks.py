@@ -0,0 +1,55 @@
+import json
+import os
+from typing import Optional
+
+from configs import THREADS_WATERMARKS_PATH
+from loguru import logger
+
+
+class WatermarkStore:
+    """
+    Per-blogger timestamp of the newest message that was already saved to the wrapper.
+
+    Values only move forward. When `path` is set, the store is read from that JSON file by `load`
+    and written back by `save`, so an incremental sync survives restarts. The worker loads it once the path
+    of its shard is known.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._watermarks: dict[int, float] = {}
+        self._dirty = False
+
+    def get(self, blogger_id: int) -> Optional[float]:
+        return self._watermarks.get(blogger_id)
+
+    def set(self, blogger_id: int, value: float) -> None:
+        if value > self._watermarks.get(blogger_id, float("-inf")):
+            self._watermarks[blogger_id] = value
+            self._dirty = True
+
+    def reset(self, blogger_id: int) -> None:
+        if self._watermarks.pop(blogger_id, None) is not None:
+            self._dirty = True
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                self._watermarks = {int(key): float(value) for key, value in json.load(file).items()}
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load threads watermarks from '{self.path}'")
+            logger.error(str(e))
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self._watermarks, file)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+watermarks = WatermarkStore(THREADS_WATERMARKS_PATH or None)
@@ -0,0 +1,258 @@
+"""
+In-process stand-ins for the wrapper, auth and ML services and for the Instagram backends.
+"""
+
+import asyncio
+import base64
+import functools
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import web
+
+
+@dataclass
+class Scenario:
+    bloggers: int = 10
+    threads: int = 10
+    messages: int = 20
+    # Latency of every fake upstream request and of every backend call, in seconds
+    upstream_latency: float = 0.005
+    backend_latency: float = 0.05
+    # Share of failed requests/calls, from 0 to 1
+    upstream_error_rate: float = 0.0
+    backend_error_rate: float = 0.0
+    # Threads of every blogger that get one new external message before every fetch after the first one,
+    # the others stay the same, so unchanged-thread skipping and incremental sync can be measured over cycles
+    new_message_threads: int = 0
+    # Creation time of the last initial message, fixed so that fetching the same thread again gives the same thread
+    started_at: float = 1700000000.0
+
+
+class FakeUpstreams:
+    """Wrapper, auth and ML HTTP APIs served from the current process, each on its own port"""
+
+    def __init__(self, scenario: Scenario) -> None:
+        self.scenario = scenario
+        self.requests: Counter = Counter()
+        self._runners: list[web.AppRunner] = []
+        self.hosts: dict[str, str] = {}
+        self._thread_ids: dict[tuple[int, str], int] = {}
+        self._message_id = 0
+
+    async def start(self) -> dict[str, str]:
+        for name, app in (("wrapper", self._wrapper_app()), ("auth", self._auth_app()), ("ml", self._ml_app())):
+            app.middlewares.append(self._middleware(name))
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.hosts[name] = f"http://127.0.0.1:{port}"
+            self._runners.append(runner)
+        return self.hosts
+
+    async def stop(self) -> None:
+        for runner in self._runners:
+            await runner.cleanup()
+
+    def _middleware(self, upstream: str):
+        @web.middleware
+        async def middleware(request: web.Request, handler):
+            resource = request.match_info.route.resource
+            path = resource.canonical if resource is not None else request.path
+            self.requests[f"{upstream} {request.method} {path}"] += 1
+            await asyncio.sleep(self.scenario.upstream_latency)
+            if random.random() < self.scenario.upstream_error_rate:
+                raise web.HTTPInternalServerError()
+            return await handler(request)
+
+        return middleware
+
+    def requests_by_upstream(self) -> dict[str, int]:
+        result: Counter = Counter()
+        for key, count in self.requests.items():
+            result[key.split(" ", 1)[0]] += count
+        return dict(result)
+
+    def _next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    # Wrapper
+
+    def _wrapper_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_get("/v1/api/blogger/get-active-bloggers", self.get_active_bloggers)
+        app.router.add_post("/v1/api/direct/threads", self.save_threads)
+        app.router.add_post("/v1/api/direct/threads/generated-message", self.save_generated_message)
+        app.router.add_get("/v1/api/direct/threads/generated-messages", self.get_generated_messages)
+        app.router.add_patch("/v1/api/direct/threads/generated-messages", self.update_message_status)
+        app.router.add_patch("/v1/api/direct/threads/generated-messages/bulk", self.update_messages_status)
+        return app
+
+    def blogger(self, blogger_id: int) -> dict:
+        return {
+            "id": blogger_id,
+            "instagram_login": f"blogger_{blogger_id}",
+            "status": "active",
+            "can_use_official_graph_api": False,
+            "facebook_page_id": None,
+            "facebook_page_access_token": None,
+        }
+
+    async def get_active_bloggers(self, _: web.Request) -> web.Response:
+        return web.json_response({"data": [self.blogger(index) for index in range(1, self.scenario.bloggers + 1)]})
+
+    async def save_threads(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        data = []
+        for thread in body["threads"]:
+            key = (body["blogger_id"], thread["instagram_id_from_instagrapi"])
+            thread_id = self._thread_ids.setdefault(key, len(self._thread_ids) + 1)
+            messages = [
+                {**message, "id": self._next_message_id(), "thread_id": thread_id} for message in thread["messages"]
+            ]
+            data.append({**thread, "id": thread_id, "messages": messages})
+        return web.json_response({"success": True, "data": data})
+
+    def generated_message(self, message_id: int, thread_id: int, text: str) -> dict:
+        return {
+            "id": message_id,
+            "thread_id": thread_id,
+            "text": text,
+            "status": "new",
+            "thread_instagram_id_from_instagrapi": str(thread_id),
+            "thread_instagram_id_from_official_graph_api": None,
+            "recipient_instagram_id_from_instagrapi": str(thread_id),
+            "recipient_instagram_id_from_official_graph_api": None,
+            "recipient_instagram_username": f"user_{thread_id}",
+        }
+
+    async def save_generated_message(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        message = self.generated_message(self._next_message_id(), body["thread_id"], body["message"])
+        return web.json_response({"success": True, "data": message})
+
+    async def get_generated_messages(self, _: web.Request) -> web.Response:
+        data = []
+        for blogger_id in range(1, self.scenario.bloggers + 1):
+            messages = [
+                self.generated_message(blogger_id * 100000 + index, blogger_id * 100000 + index, "Hello!")
+                for index in range(self.scenario.threads)
+            ]
+            data.append({**self.blogger(blogger_id), "messages": messages})
+        return web.json_response({"data": data})
+
+    async def update_message_status(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        message = self.generated_message(body["id"], body["id"], "Hello!")
+        return web.json_response({"success": True, "data": {**message, "status": body["status"]}})
+
+    async def update_messages_status(self, request: web.Request) -> web.Response:
+        await request.json()
+        return web.json_response({"success": True})
+
+    # Auth
+
+    def _auth_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/v1/session/{login}", self.get_session)
+        return app
+
+    async def get_session(self, request: web.Request) -> web.Response:
+        session = {"uuids": {}, "cookies": {}, "authorization_data": {}, "device_settings": {}}
+        packed_session = base64.b64encode(zlib.compress(json.dumps(session).encode())).decode()
+        return web.json_response({"session": packed_session, "proxy": None})
+
+    # ML
+
+    def _ml_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_post("/predict", self.predict)
+        return app
+
+    async def predict(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        return web.json_response({"texts": [f"Answer to: {dialog['user']}" for dialog in body["data"]["dialogs"]]})
+
+
+@functools.cache
+def make_fake_backend_class():
+    """
+    Returns an Instagram backend that builds scenario threads after a blocking sleep, like the real SDK calls.
+    The class is built on demand, because the service modules read the configs when they are imported,
+    and only once, so it counts the fetches of every blogger over all cycles.
+    """
+    from api.schemas import DataThreadMessageRequest, DataThreadRequest
+    from backends.base import BaseDirectBackend
+    from base.executors import BlockingCallRunner
+    from configs import INSTAGRAPI_MAX_CONCURRENCY
+
+    class FakeBackend(BaseDirectBackend):
+        runner = BlockingCallRunner("fake", INSTAGRAPI_MAX_CONCURRENCY)
+        fetches: Counter = Counter()
+
+        def __init__(self, blogger_id: int, scenario: Scenario) -> None:
+            self.blogger_id = blogger_id
+            self.scenario = scenario
+
+        def _call(self) -> None:
+            time.sleep(self.scenario.backend_latency)
+            if random.random() < self.scenario.backend_error_rate:
+                raise RuntimeError("Fake backend error")
+
+        async def get_all_threads(self, since: Optional[float] = None) -> list[DataThreadRequest]:
+            await self.run_blocking(self._call)
+            new_messages = self.fetches[self.blogger_id]
+            self.fetches[self.blogger_id] += 1
+            threads = []
+            for thread_index in range(self.scenario.threads):
+                messages_count = self.scenario.messages
+                if thread_index < self.scenario.new_message_threads:
+                    messages_count += new_messages
+                messages = []
+                for message_index in range(messages_count):
+                    created_at = self.scenario.started_at + (message_index - self.scenario.messages + 1) * 60
+                    if since is not None and created_at <= since:
+                        continue
+                    external = (
+                        message_index % 2 == 0
+                        or message_index == self.scenario.messages - 1
+                        or message_index >= self.scenario.messages
+                    )
+                    messages.append(
+                        DataThreadMessageRequest(
+                            instagram_id_from_instagrapi=f"{self.blogger_id}-{thread_index}-{message_index}",
+                            instagram_id_from_official_graph_api=None,
+                            instagram_user_id_from_instagrapi=str(thread_index),
+                            instagram_user_id_from_official_graph_api=None,
+                            created_at=created_at,
+                            sender="external_user" if external else "blogger",
+                            item_type="text",
+                            text=f"Message {message_index} in thread {thread_index}",
+                            link=None,
+                        )
+                    )
+                if messages:
+                    threads.append(
+                        DataThreadRequest(
+                            instagram_id_from_instagrapi=f"{self.blogger_id}-{thread_index}",
+                            instagram_id_from_official_graph_api=None,
+                            thread_to_user_id_from_instagrapi=str(thread_index),
+                            thread_to_user_id_from_official_graph_api=None,
+                            thread_to_username=f"user_{thread_index}",
+                            messages=messages,
+                        )
+                    )
+            return threads
+
+        async def send_message(self, message) -> None:
+            await self.run_blocking(self._call)
+
+    return FakeBackend
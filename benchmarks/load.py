@@ -0,0 +1,159 @@
+"""
+End-to-end load benchmark of the publisher and the consumer against in-process fake upstreams.
+
+    python -m benchmarks.load --bloggers 50 --threads 20 --messages 30 --output bench.json
+    python -m benchmarks.load --cycles 3 --new-message-threads 2
+
+With several cycles, only the threads given by --new-message-threads change between fetches.
+
+Prints one JSON document per run: cycle time, requests per upstream and endpoint,
+p50/p99 latency of every pipeline stage, peak tasks and RSS of every cycle and peak RSS of the run,
+so results can be compared between commits.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from dataclasses import asdict
+
+from benchmarks.fakes import FakeUpstreams, Scenario, make_fake_backend_class
+
+# Required settings the benchmark doesn't use and a consumer pacing without pauses, the environment takes precedence
+BENCHMARK_ENV = {
+    "APP_PORT": "0",
+    "SENTRY_DSN": "",
+    "STATUS_BUFFER_PATH": "",
+    "CONSUMER_ACCOUNT_MESSAGES_PER_MINUTE": "600000",
+    "CONSUMER_ACCOUNT_BURST": "1000",
+    "CONSUMER_ACCOUNT_JITTER_MIN": "0",
+    "CONSUMER_ACCOUNT_JITTER_MAX": "0",
+}
+
+
+async def run_publisher_cycle(scenario: Scenario) -> dict:
+    from base.resources import ResourceMonitor
+    from manager import DirectManager
+    from publisher import build_pipeline
+
+    fake_backend_class = make_fake_backend_class()
+
+    class BenchmarkManager(DirectManager):
+        @staticmethod
+        async def get_instagram_backend(blogger):
+            return fake_backend_class(blogger.id, scenario)
+
+    manager = BenchmarkManager()
+    started_at = time.monotonic()
+    bloggers = await manager.get_active_bloggers()
+    pipeline = build_pipeline(manager)
+    async with ResourceMonitor("publisher") as monitor:
+        stats = await pipeline.run(bloggers)
+    return {
+        "cycle_time": round(time.monotonic() - started_at, 3),
+        "answers_saved": stats[-1].emitted,
+        **monitor.as_dict(),
+        "stages": [stage_stats.as_dict() for stage_stats in stats],
+    }
+
+
+async def run_consumer_cycle(scenario: Scenario) -> dict:
+    from base.resources import ResourceMonitor
+    from base.status_buffer import StatusUpdateBuffer
+    from consumer import DeliveryScheduler
+    from manager import DirectManager
+
+    fake_backend_class = make_fake_backend_class()
+
+    class BenchmarkManager(DirectManager):
+        @staticmethod
+        async def get_instagram_backend(blogger):
+            return fake_backend_class(blogger.id, scenario)
+
+    manager = BenchmarkManager()
+    status_buffer = StatusUpdateBuffer(
+        send_bulk=DirectManager.update_messages_status,
+        send_single=DirectManager.update_message_status_by_update,
+        path="",
+    )
+    started_at = time.monotonic()
+    bloggers = await manager.get_messages_for_publishing()
+    async with ResourceMonitor("consumer") as monitor:
+        scheduler = DeliveryScheduler(status_buffer)
+        await scheduler.deliver(manager, bloggers)
+        await scheduler.join()
+    await status_buffer.stop()
+    return {
+        "cycle_time": round(time.monotonic() - started_at, 3),
+        **monitor.as_dict(),
+        "messages_sent": sum(len(blogger.messages) for blogger in bloggers),
+    }
+
+
+async def run(scenario: Scenario, cycles: int) -> dict:
+    upstreams = FakeUpstreams(scenario)
+    hosts = await upstreams.start()
+    for key, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ["WRAPPER_SERVICE_HOST"] = hosts["wrapper"]
+    os.environ["AUTH_SERVICE_HOST"] = hosts["auth"]
+    os.environ["ML_SERVICE_HOST"] = hosts["ml"]
+
+    from base.executors import shutdown_executor
+    from base.http import http_clients
+    from base.resources import get_peak_rss_mb
+
+    await http_clients.start()
+    try:
+        publisher_cycles = [await run_publisher_cycle(scenario) for _ in range(cycles)]
+        consumer_cycles = [await run_consumer_cycle(scenario) for _ in range(cycles)]
+    finally:
+        await http_clients.close()
+        shutdown_executor()
+        await upstreams.stop()
+
+    return {
+        "scenario": asdict(scenario),
+        "publisher": publisher_cycles,
+        "consumer": consumer_cycles,
+        "requests_by_upstream": upstreams.requests_by_upstream(),
+        "requests_by_endpoint": dict(upstreams.requests),
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bloggers", type=int, default=Scenario.bloggers)
+    parser.add_argument("--threads", type=int, default=Scenario.threads)
+    parser.add_argument("--messages", type=int, default=Scenario.messages)
+    parser.add_argument("--upstream-latency", type=float, default=Scenario.upstream_latency)
+    parser.add_argument("--backend-latency", type=float, default=Scenario.backend_latency)
+    parser.add_argument("--upstream-error-rate", type=float, default=Scenario.upstream_error_rate)
+    parser.add_argument("--backend-error-rate", type=float, default=Scenario.backend_error_rate)
+    parser.add_argument("--new-message-threads", type=int, default=Scenario.new_message_threads)
+    parser.add_argument("--cycles", type=int, default=1)
+    parser.add_argument("--output", help="File to write the JSON results to, stdout by default")
+    args = parser.parse_args()
+
+    scenario = Scenario(
+        bloggers=args.bloggers,
+        threads=args.threads,
+        messages=args.messages,
+        upstream_latency=args.upstream_latency,
+        backend_latency=args.backend_latency,
+        upstream_error_rate=args.upstream_error_rate,
+        backend_error_rate=args.backend_error_rate,
+        new_message_threads=args.new_message_threads,
+    )
+    result = json.dumps(asyncio.run(run(scenario, args.cycles)), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(result)
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+CPU time of parsing and serializing bulk wrapper payloads, the previous way against the current one.
+
+    python -m benchmarks.serialization --messages 10000 --messages-per-thread 50 --repeat 5
+
+Prints one JSON document with the best CPU time of each variant in milliseconds per 10k messages.
+Parsing is `response.json()` and a model per item before, `parse_raw` of the envelope now.
+Serializing is `.dict()` of every thread before, `dump_model` now, both followed by `json.dumps` like aiohttp does.
+"""
+
+import argparse
+import json
+import time
+from typing import Callable
+
+from api.schemas import DataThread, DataThreadRequest, ThreadsResponse
+from base.serialization import dump_model
+
+
+def make_threads_payload(messages: int, messages_per_thread: int) -> bytes:
+    threads = []
+    for thread_id in range(max(1, messages // messages_per_thread)):
+        thread_messages = [
+            {
+                "id": thread_id * messages_per_thread + index,
+                "thread_id": thread_id,
+                "instagram_id_from_instagrapi": f"{thread_id}-{index}",
+                "instagram_id_from_official_graph_api": None,
+                "instagram_user_id_from_instagrapi": str(thread_id),
+                "instagram_user_id_from_official_graph_api": None,
+                "created_at": 1700000000.0 + index,
+                "sender": "blogger" if index % 2 else "external_user",
+                "item_type": "text",
+                "text": f"Message {index} of thread {thread_id}, long enough to look like a real one",
+                "link": None,
+            }
+            for index in range(messages_per_thread)
+        ]
+        threads.append(
+            {
+                "id": thread_id,
+                "instagram_id_from_instagrapi": str(thread_id),
+                "instagram_id_from_official_graph_api": None,
+                "thread_to_user_id_from_instagrapi": str(thread_id),
+                "thread_to_user_id_from_official_graph_api": None,
+                "thread_to_username": f"user_{thread_id}",
+                "messages": thread_messages,
+            }
+        )
+    return json.dumps({"data": threads}).encode()
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.process_time()
+        func()
+        best = min(best, time.process_time() - started_at)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--messages-per-thread", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    raw = make_threads_payload(args.messages, args.messages_per_thread)
+    threads = ThreadsResponse.parse_raw(raw).data
+    requests = [DataThreadRequest(**thread.dict()) for thread in threads]
+    if [dump_model(thread) for thread in requests] != [thread.dict() for thread in requests]:
+        raise AssertionError("dump_model and .dict() give different results")
+
+    variants = {
+        "parse_previous": lambda: [DataThread(**item) for item in json.loads(raw)["data"]],
+        "parse_current": lambda: ThreadsResponse.parse_raw(raw).data,
+        "serialize_previous": lambda: json.dumps({"threads": [thread.dict() for thread in requests]}),
+        "serialize_current": lambda: json.dumps({"threads": [dump_model(thread) for thread in requests]}),
+    }
+    per_10k = 10000 / args.messages
+    result = {
+        "messages": args.messages,
+        "payload_kb": round(len(raw) / 1024, 1),
+        "cpu_ms_per_10k_messages": {
+            name: round(measure(func, args.repeat) * 1000 * per_10k, 2) for name, func in variants.items()
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
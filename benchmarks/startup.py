@@ -0,0 +1,79 @@
+"""
+Import time and RSS of every entry point, each measured in a fresh interpreter.
+
+    python -m benchmarks.startup --repeat 5 --output startup.json
+
+Prints one JSON document with the best import time, the RSS after import and the heavy libraries
+every entry point loaded, so startup regressions can be compared between commits.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.load import BENCHMARK_ENV
+
+ENTRY_POINTS = ["publisher", "consumer", "main"]
+
+# Libraries that are only needed by some deployments or by the API app
+HEAVY_MODULES = ["fastapi", "instagrapi", "pyfacebook", "sentry_sdk", "PIL"]
+
+# Hosts are only read at import, nothing is requested
+STARTUP_ENV = {
+    **BENCHMARK_ENV,
+    "AUTH_SERVICE_HOST": "http://127.0.0.1",
+    "WRAPPER_SERVICE_HOST": "http://127.0.0.1",
+    "ML_SERVICE_HOST": "http://127.0.0.1",
+}
+
+MEASURE_SCRIPT = """
+import json, sys, time
+started_at = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - started_at
+from base.resources import get_rss_mb
+print(json.dumps({{
+    "import_time": import_time,
+    "rss_mb": get_rss_mb(),
+    "modules": len(sys.modules),
+    "heavy_modules": [name for name in {heavy_modules!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(module: str) -> dict:
+    env = {**STARTUP_ENV, **os.environ}
+    script = MEASURE_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entry-points", nargs="+", default=ENTRY_POINTS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Also write the result to this file")
+    args = parser.parse_args()
+
+    result = {}
+    for module in args.entry_points:
+        runs = [measure(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["import_time"])
+        result[module] = {
+            "import_time_ms": round(best["import_time"] * 1000, 1),
+            "rss_mb": max(run["rss_mb"] for run in runs),
+            "modules": best["modules"],
+            "heavy_modules": best["heavy_modules"],
+        }
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
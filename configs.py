@@ -8,3 +8,137 @@ WRAPPER_SERVICE_HOST = env.str("WRAPPER_SERVICE_HOST")
 ML_SERVICE_HOST = env.str("ML_SERVICE_HOST")
 APP_PORT = env.int("APP_PORT")
 SENTRY_DSN = env.str("SENTRY_DSN")
+
+# HTTP clients
+HTTP_KEEPALIVE_TIMEOUT = env.float("HTTP_KEEPALIVE_TIMEOUT", 30)
+HTTP_DNS_CACHE_TTL = env.int("HTTP_DNS_CACHE_TTL", 300)
+WRAPPER_SERVICE_CONNECTIONS_LIMIT = env.int("WRAPPER_SERVICE_CONNECTIONS_LIMIT", 50)
+WRAPPER_SERVICE_TIMEOUT = env.float("WRAPPER_SERVICE_TIMEOUT", 60)
+ML_SERVICE_CONNECTIONS_LIMIT = env.int("ML_SERVICE_CONNECTIONS_LIMIT", 20)
+ML_SERVICE_TIMEOUT = env.float("ML_SERVICE_TIMEOUT", 120)
+AUTH_SERVICE_CONNECTIONS_LIMIT = env.int("AUTH_SERVICE_CONNECTIONS_LIMIT", 20)
+AUTH_SERVICE_TIMEOUT = env.float("AUTH_SERVICE_TIMEOUT", 30)
+
+# Blocking backend calls
+BACKEND_EXECUTOR_MAX_WORKERS = env.int("BACKEND_EXECUTOR_MAX_WORKERS", 32)
+INSTAGRAPI_MAX_CONCURRENCY = env.int("INSTAGRAPI_MAX_CONCURRENCY", 16)
+FACEBOOK_MAX_CONCURRENCY = env.int("FACEBOOK_MAX_CONCURRENCY", 16)
+
+# Instagrapi clients cache
+INSTAGRAPI_CLIENTS_CACHE_SIZE = env.int("INSTAGRAPI_CLIENTS_CACHE_SIZE", 1000)
+INSTAGRAPI_CLIENTS_CACHE_TTL = env.float("INSTAGRAPI_CLIENTS_CACHE_TTL", 3600)
+
+# Instagrapi inbox fetching, limits of threads per inbox and of messages per thread
+INSTAGRAPI_THREADS_LIMIT = env.int("INSTAGRAPI_THREADS_LIMIT", 20)
+INSTAGRAPI_PENDING_THREADS_LIMIT = env.int("INSTAGRAPI_PENDING_THREADS_LIMIT", 20)
+INSTAGRAPI_THREAD_MESSAGES_LIMIT = env.int("INSTAGRAPI_THREAD_MESSAGES_LIMIT", 20)
+
+# Threads sync. "full" re-sends every thread, "incremental" sends only messages newer than the blogger watermark
+# and relies on the wrapper merging them into the stored threads
+THREADS_SYNC_MODE = env.str("THREADS_SYNC_MODE", "full")
+THREADS_WATERMARKS_PATH = env.str("THREADS_WATERMARKS_PATH", "")
+
+# ML requests batching, ML_BATCH_SIZE=1 disables it
+ML_BATCH_SIZE = env.int("ML_BATCH_SIZE", 16)
+ML_BATCH_MAX_WAIT = env.float("ML_BATCH_MAX_WAIT", 0.1)
+# Generation settings and the dialog history sent with every ML request, a 0 limit disables it
+ML_TEMPERATURE = env.float("ML_TEMPERATURE", 0.7)
+ML_MAX_TOKENS = env.int("ML_MAX_TOKENS", 1000)
+ML_TOP_P = env.float("ML_TOP_P", 1)
+ML_FREQUENCY_PENALTY = env.float("ML_FREQUENCY_PENALTY", 0)
+ML_PRESENCE_PENALTY = env.float("ML_PRESENCE_PENALTY", 0)
+ML_HISTORY_MAX_TURNS = env.int("ML_HISTORY_MAX_TURNS", 20)
+ML_HISTORY_MAX_CHARS = env.int("ML_HISTORY_MAX_CHARS", 6000)
+# Consecutive messages of one sender become a single turn
+ML_HISTORY_MERGE_SAME_SENDER = env.bool("ML_HISTORY_MERGE_SAME_SENDER", False)
+# Concurrent ML requests, waiting for a free slot doesn't count towards ML_SERVICE_TIMEOUT
+ML_MAX_CONCURRENCY = env.int("ML_MAX_CONCURRENCY", 16)
+
+# Wrapper list endpoints, with a page size of 0 the whole list is streamed from a single response
+WRAPPER_PAGE_SIZE = env.int("WRAPPER_PAGE_SIZE", 0)
+WRAPPER_STREAM_CHUNK_SIZE = env.int("WRAPPER_STREAM_CHUNK_SIZE", 65536)
+
+# Publisher pipeline, fetch workers bound the bloggers processed at once and generate workers the threads
+PUBLISHER_FETCH_WORKERS = env.int("PUBLISHER_FETCH_WORKERS", 16)
+PUBLISHER_SAVE_WORKERS = env.int("PUBLISHER_SAVE_WORKERS", 8)
+PUBLISHER_GENERATE_WORKERS = env.int("PUBLISHER_GENERATE_WORKERS", 32)
+PUBLISHER_SAVE_ANSWER_WORKERS = env.int("PUBLISHER_SAVE_ANSWER_WORKERS", 8)
+PUBLISHER_QUEUE_SIZE = env.int("PUBLISHER_QUEUE_SIZE", 100)
+
+# Consumer delivery lanes, the throttling applies to every instagram account separately
+CONSUMER_MAX_CONCURRENT_SENDS = env.int("CONSUMER_MAX_CONCURRENT_SENDS", 20)
+CONSUMER_ACCOUNT_MESSAGES_PER_MINUTE = env.float("CONSUMER_ACCOUNT_MESSAGES_PER_MINUTE", 6)
+CONSUMER_ACCOUNT_BURST = env.float("CONSUMER_ACCOUNT_BURST", 1)
+CONSUMER_ACCOUNT_JITTER_MIN = env.float("CONSUMER_ACCOUNT_JITTER_MIN", 3)
+CONSUMER_ACCOUNT_JITTER_MAX = env.float("CONSUMER_ACCOUNT_JITTER_MAX", 10)
+
+# Write-behind buffer for statuses of generated messages, an empty path keeps it in memory
+STATUS_BUFFER_PATH = env.str("STATUS_BUFFER_PATH", "status_updates.sqlite3")
+STATUS_BUFFER_MAX_SIZE = env.int("STATUS_BUFFER_MAX_SIZE", 50)
+STATUS_BUFFER_FLUSH_INTERVAL = env.float("STATUS_BUFFER_FLUSH_INTERVAL", 5)
+
+# Facebook Graph API fetching
+FACEBOOK_CONVERSATIONS_PAGE_SIZE = env.int("FACEBOOK_CONVERSATIONS_PAGE_SIZE", 25)
+FACEBOOK_MAX_CONVERSATIONS = env.int("FACEBOOK_MAX_CONVERSATIONS", 100)
+FACEBOOK_MESSAGES_PAGE_SIZE = env.int("FACEBOOK_MESSAGES_PAGE_SIZE", 25)
+FACEBOOK_MESSAGES_LIMIT = env.int("FACEBOOK_MESSAGES_LIMIT", 25)
+
+# Observability
+SENTRY_TRACES_SAMPLE_RATE = env.float("SENTRY_TRACES_SAMPLE_RATE", 1.0)
+SENTRY_PROFILES_SAMPLE_RATE = env.float("SENTRY_PROFILES_SAMPLE_RATE", 1.0)
+# Port of the /metrics endpoint of the publisher and consumer workers, 0 disables it
+METRICS_PORT = env.int("METRICS_PORT", 0)
+
+# Thread fingerprints, unchanged threads skip saving and generation
+THREAD_FINGERPRINTS_ENABLED = env.bool("THREAD_FINGERPRINTS_ENABLED", True)
+THREAD_FINGERPRINTS_CACHE_SIZE = env.int("THREAD_FINGERPRINTS_CACHE_SIZE", 100000)
+THREAD_FINGERPRINTS_PATH = env.str("THREAD_FINGERPRINTS_PATH", "")
+
+# Cache of generated answers by dialog hash
+ML_ANSWERS_CACHE_SIZE = env.int("ML_ANSWERS_CACHE_SIZE", 10000)
+ML_ANSWERS_CACHE_TTL = env.float("ML_ANSWERS_CACHE_TTL", 3600)
+
+# Threads with an unsent generated answer skip generation until a newer blogger message shows it was sent
+ML_PENDING_ANSWERS_CACHE_SIZE = env.int("ML_PENDING_ANSWERS_CACHE_SIZE", 100000)
+ML_PENDING_ANSWERS_TTL = env.float("ML_PENDING_ANSWERS_TTL", 3600)
+
+# Adaptive polling, a blogger with new messages is polled after the min interval, an idle one backs off to the max
+POLL_MIN_INTERVAL = env.float("POLL_MIN_INTERVAL", 15)
+POLL_MAX_INTERVAL = env.float("POLL_MAX_INTERVAL", 600)
+POLL_BACKOFF_FACTOR = env.float("POLL_BACKOFF_FACTOR", 2)
+PUBLISHER_MAX_BLOGGERS_PER_CYCLE = env.int("PUBLISHER_MAX_BLOGGERS_PER_CYCLE", 100)
+PUBLISHER_BLOGGERS_REFRESH_INTERVAL = env.float("PUBLISHER_BLOGGERS_REFRESH_INTERVAL", 60)
+CONSUMER_POLL_MIN_INTERVAL = env.float("CONSUMER_POLL_MIN_INTERVAL", 10)
+CONSUMER_POLL_MAX_INTERVAL = env.float("CONSUMER_POLL_MAX_INTERVAL", 60)
+
+# Instagram messaging webhooks, when enabled Graph API bloggers are only polled for reconciliation
+WEBHOOKS_ENABLED = env.bool("WEBHOOKS_ENABLED", False)
+FACEBOOK_APP_SECRET = env.str("FACEBOOK_APP_SECRET", "")
+FACEBOOK_WEBHOOK_VERIFY_TOKEN = env.str("FACEBOOK_WEBHOOK_VERIFY_TOKEN", "")
+WEBHOOK_WORKERS = env.int("WEBHOOK_WORKERS", 8)
+WEBHOOK_QUEUE_SIZE = env.int("WEBHOOK_QUEUE_SIZE", 1000)
+WEBHOOK_BLOGGERS_REFRESH_INTERVAL = env.float("WEBHOOK_BLOGGERS_REFRESH_INTERVAL", 300)
+WEBHOOK_CONVERSATIONS_CACHE_SIZE = env.int("WEBHOOK_CONVERSATIONS_CACHE_SIZE", 10000)
+WEBHOOK_RECONCILIATION_INTERVAL = env.float("WEBHOOK_RECONCILIATION_INTERVAL", 1800)
+
+# Circuit breakers of the upstreams and of every instagram account, retries of idempotent upstream calls
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = env.int("CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5)
+CIRCUIT_BREAKER_RESET_TIMEOUT = env.float("CIRCUIT_BREAKER_RESET_TIMEOUT", 30)
+ACCOUNT_CIRCUIT_BREAKER_FAILURE_THRESHOLD = env.int("ACCOUNT_CIRCUIT_BREAKER_FAILURE_THRESHOLD", 3)
+ACCOUNT_CIRCUIT_BREAKER_RESET_TIMEOUT = env.float("ACCOUNT_CIRCUIT_BREAKER_RESET_TIMEOUT", 300)
+RETRY_ATTEMPTS = env.int("RETRY_ATTEMPTS", 3)
+RETRY_BASE_DELAY = env.float("RETRY_BASE_DELAY", 0.5)
+RETRY_MAX_DELAY = env.float("RETRY_MAX_DELAY", 10)
+
+# Sharding of the publisher and consumer workers by blogger id, also set by --shard-index / --shard-count
+SHARD_INDEX = env.int("SHARD_INDEX", 0)
+SHARD_COUNT = env.int("SHARD_COUNT", 1)
+
+# On-demand sync, generation and delivery jobs of the API app. Delivery is left to the consumer, the API only
+# asks it to poll right away through its metrics server: CONSUMER_HOSTS are their urls in shard index order,
+# delivery requests are rejected when there are none
+DIRECT_JOBS_CACHE_SIZE = env.int("DIRECT_JOBS_CACHE_SIZE", 1000)
+DIRECT_JOBS_TTL = env.float("DIRECT_JOBS_TTL", 3600)
+CONSUMER_HOSTS = env.list("CONSUMER_HOSTS", [])
+CONSUMER_CONNECTIONS_LIMIT = env.int("CONSUMER_CONNECTIONS_LIMIT", 10)
+CONSUMER_TIMEOUT = env.float("CONSUMER_TIMEOUT", 10)
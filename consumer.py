@@ -1,66 +1,257 @@
 import asyncio
-import random
-from typing import Optional
+import sqlite3
+from typing import AsyncIterable, Iterable, Optional, Union
 
-import sentry_sdk
-from aiohttp import ClientConnectorError, ClientResponseError
-from api.schemas import DataBloggerWithGeneratedMessages
-from configs import SENTRY_DSN
+from aiohttp import web
+from api.schemas import (
+    DataBloggerWithGeneratedMessages,
+    DataGeneratedMessage,
+    GeneratedMessageStatusUpdate,
+)
+from base.executors import shutdown_executor
+from base.http import http_clients
+from base.metrics import (
+    messages_failed,
+    messages_sent,
+    start_metrics_server,
+    tasks_in_progress,
+)
+from base.rate_limit import TokenBucket
+from base.resilience import UPSTREAM_ERRORS, CircuitOpenError
+from base.resources import ResourceMonitor
+from base.sentry import init_sentry
+from base.sharding import Shard, parse_shard_args
+from base.status_buffer import StatusUpdateBuffer
+from base.streaming import aiterate
+from configs import (
+    CONSUMER_ACCOUNT_BURST,
+    CONSUMER_ACCOUNT_JITTER_MAX,
+    CONSUMER_ACCOUNT_JITTER_MIN,
+    CONSUMER_ACCOUNT_MESSAGES_PER_MINUTE,
+    CONSUMER_MAX_CONCURRENT_SENDS,
+    CONSUMER_POLL_MAX_INTERVAL,
+    CONSUMER_POLL_MIN_INTERVAL,
+    METRICS_PORT,
+    POLL_BACKOFF_FACTOR,
+    STATUS_BUFFER_FLUSH_INTERVAL,
+    STATUS_BUFFER_MAX_SIZE,
+    STATUS_BUFFER_PATH,
+)
 from loguru import logger
 from manager import DirectManager
 
-sentry_sdk.init(
-    dsn=SENTRY_DSN,
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
+init_sentry()
+
+
+# Set through POST /deliver of the metrics server by the API app, so a delivery it was asked for starts right away
+delivery_requested = asyncio.Event()
+
+
+async def request_delivery(request: web.Request) -> web.Response:
+    logger.debug(f"Delivery was requested for blogger '{request.query.get('blogger_id')}'")
+    delivery_requested.set()
+    return web.json_response({"Success": True}, status=202)
+
+
+class DeliveryScheduler:
+    """
+    Delivers generated messages with a separate lane per blogger, lanes run on their own next to the polling.
+
+    Inside a lane messages are sent one by one and throttled by the blogger's token bucket,
+    so every Instagram account keeps its own pace while the total throughput grows with the number of accounts.
+    A blogger with a large backlog only keeps its own lane busy, polls meanwhile skip the blogger
+    and its newer messages are picked up by the first poll after the lane finished.
+    """
+
+    def __init__(
+        self, status_buffer: StatusUpdateBuffer, max_concurrent_sends: int = CONSUMER_MAX_CONCURRENT_SENDS
+    ) -> None:
+        self.status_buffer = status_buffer
+        self._buckets: dict[int, TokenBucket] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent_sends)
+        self._lanes: dict[int, asyncio.Task] = {}
+
+    def get_bucket(self, blogger: DataBloggerWithGeneratedMessages) -> TokenBucket:
+        if blogger.id not in self._buckets:
+            self._buckets[blogger.id] = TokenBucket(
+                rate=CONSUMER_ACCOUNT_MESSAGES_PER_MINUTE / 60,
+                capacity=CONSUMER_ACCOUNT_BURST,
+                jitter=(CONSUMER_ACCOUNT_JITTER_MIN, CONSUMER_ACCOUNT_JITTER_MAX),
+            )
+        return self._buckets[blogger.id]
+
+    async def deliver(
+        self,
+        manager: DirectManager,
+        bloggers: Union[Iterable, AsyncIterable[Optional[DataBloggerWithGeneratedMessages]]],
+    ) -> int:
+        """
+        Starts the lane of every blogger as soon as the blogger is received, without waiting for the lanes.
+        Bloggers whose lane is still running are skipped. Returns the number of lanes started.
+        """
+        # Messages whose status is still in the local buffer were already handled, the wrapper just doesn't know yet
+        pending_ids = self.status_buffer.pending_ids()
+        count = 0
+        async for blogger in aiterate(bloggers):
+            if blogger is None or blogger.id in self._lanes:
+                continue
+            blogger.messages = [message for message in blogger.messages or [] if message.id not in pending_ids]
+            if blogger.messages:
+                self.start_lane(manager, blogger)
+                count += 1
+        return count
 
+    def start_lane(self, manager: DirectManager, blogger: DataBloggerWithGeneratedMessages) -> None:
+        lane = asyncio.create_task(self.run_lane(manager, blogger))
+        self._lanes[blogger.id] = lane
+        lane.add_done_callback(lambda _: self.finish_lane(blogger, lane))
 
-async def main():
-    while True:
-        manager = DirectManager()
+    def finish_lane(self, blogger: DataBloggerWithGeneratedMessages, lane: asyncio.Task) -> None:
+        self._lanes.pop(blogger.id, None)
+        if not lane.cancelled() and lane.exception() is not None:
+            logger.error(f"Delivery lane of instagram login '{blogger.instagram_login}' was stopped")
+            logger.error(str(lane.exception()))
+
+    @property
+    def running(self) -> int:
+        return len(self._lanes)
+
+    async def join(self) -> None:
+        """Waits for the running lanes"""
+        await asyncio.gather(*self._lanes.values(), return_exceptions=True)
+
+    async def stop(self) -> None:
+        """Cancels the running lanes, their unsent messages come back with the next poll after a restart"""
+        for lane in self._lanes.values():
+            lane.cancel()
+        await self.join()
+
+    async def run_lane(self, manager: DirectManager, blogger: DataBloggerWithGeneratedMessages) -> None:
+        bucket = self.get_bucket(blogger)
+        for message in blogger.messages:
+            await bucket.acquire()
+            async with self._semaphore:
+                with tasks_in_progress.track_in_progress(stage="deliver_message"):
+                    await self.deliver_message(manager, blogger, message)
+            await bucket.pause()
+
+    async def deliver_message(
+        self, manager: DirectManager, blogger: DataBloggerWithGeneratedMessages, message: DataGeneratedMessage
+    ) -> None:
+        logger.debug(
+            f"Trying send message from instagram login '{blogger.instagram_login}'"
+            f" to username '{message.recipient_instagram_username}'"
+        )
         try:
-            logger.debug("Trying to get messages for publishing")
-            bloggers_with_messages_for_publishing: list[
-                Optional[DataBloggerWithGeneratedMessages]
-            ] = await manager.get_messages_for_publishing()
-        except (ClientResponseError, ClientConnectorError) as e:
-            logger.error("Error for getting messages for publishing")
+            await manager.send_message(message, blogger)
+            messages_sent.inc()
+            await self.status_buffer.add(GeneratedMessageStatusUpdate(id=message.id, status="sent"))
+            logger.debug(
+                f"Message from instagram login '{blogger.instagram_login}'"
+                f" to username '{message.recipient_instagram_username}' was successfully sent"
+            )
+        except CircuitOpenError as e:
+            # The account keeps failing, the message stays unsent in the wrapper and comes back with a later poll
+            logger.debug(f"Message to username '{message.recipient_instagram_username}' was postponed. {e}")
+        except Exception as e:
+            messages_failed.inc()
+            await self.status_buffer.add(GeneratedMessageStatusUpdate(id=message.id, status="error", error=str(e)))
+            logger.debug(
+                f"Message from instagram login '{blogger.instagram_login}'"
+                f" to username '{message.recipient_instagram_username}' wasn't sent"
+            )
             logger.error(str(e))
-            await asyncio.sleep(60)
-            continue
 
-        logger.debug(f"Count bloggers with messages for publishing: {len(bloggers_with_messages_for_publishing)}")
 
-        for blogger_with_messages_for_publishing in bloggers_with_messages_for_publishing:
-            for message_for_publishing in blogger_with_messages_for_publishing.messages:
+async def main(status_buffer: StatusUpdateBuffer, shard: Optional[Shard] = None):
+    shard = shard or Shard()
+    scheduler = DeliveryScheduler(status_buffer)
+    # The wrapper returns the messages of all bloggers in one response, so there is nothing to poll per blogger.
+    # The interval drops to the min after a poll with messages and backs off to the max while there are none
+    interval = CONSUMER_POLL_MIN_INTERVAL
+    try:
+        while True:
+            delivery_requested.clear()
+            manager = DirectManager()
+            # Stores of removed shards are taken over once their consumers stopped, which may be after this one started
+            merge_orphaned_status_buffers(status_buffer, shard)
+            await status_buffer.flush()
+            bloggers_with_messages_for_publishing = (
+                blogger
+                async for blogger in manager.iter_messages_for_publishing()
+                if blogger is not None and shard.owns(blogger.id)
+            )
+            count = 0
+            try:
+                logger.debug("Trying to get messages for publishing")
+                async with ResourceMonitor("consumer") as monitor:
+                    count = await scheduler.deliver(manager, bloggers_with_messages_for_publishing)
+            except UPSTREAM_ERRORS as e:
+                logger.error("Error for getting messages for publishing")
+                logger.error(str(e))
+            else:
                 logger.debug(
-                    f"Trying send message from instagram login '{blogger_with_messages_for_publishing.instagram_login}'"
-                    f" to username '{message_for_publishing.recipient_instagram_username}'"
+                    f"Count bloggers with messages for publishing: {count}, running lanes: {scheduler.running}"
                 )
-                try:
-                    await manager.send_message(message_for_publishing, blogger_with_messages_for_publishing)
-                    await manager.update_message_status(message_for_publishing, status="sent")
-                    logger.debug(
-                        f"Message from instagram login '{blogger_with_messages_for_publishing.instagram_login}'"
-                        f" to username '{message_for_publishing.recipient_instagram_username}' was successfully sent"
-                    )
-                except Exception as e:
-                    await manager.update_message_status(message_for_publishing, status="error", error=str(e))
-                    logger.debug(
-                        f"Message from instagram login '{blogger_with_messages_for_publishing.instagram_login}'"
-                        f" to username '{message_for_publishing.recipient_instagram_username}' wasn't sent"
-                    )
-                    logger.error(str(e))
-                await asyncio.sleep(random.randint(3, 10))
-            await asyncio.sleep(60)
-        await asyncio.sleep(60)
+                monitor.log()
+
+            # Running lanes don't hold the polling back, bloggers without a running lane are polled at the same pace
+            if count or scheduler.running:
+                interval = CONSUMER_POLL_MIN_INTERVAL
+            else:
+                interval = min(interval * POLL_BACKOFF_FACTOR, CONSUMER_POLL_MAX_INTERVAL)
+            try:
+                await asyncio.wait_for(delivery_requested.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await scheduler.stop()
+
+
+def merge_orphaned_status_buffers(status_buffer: StatusUpdateBuffer, shard: Shard) -> None:
+    """
+    Takes over the unflushed statuses of shards that no longer exist, so their messages are neither
+    delivered again nor left without a status. Any shard on the host may take them, the updates are idempotent.
+    A store is only taken once its consumer stopped, e.g. an old shard during a rolling deploy keeps it until then.
+    """
+    for path in shard.get_orphaned_paths(STATUS_BUFFER_PATH):
+        try:
+            count = status_buffer.merge(path)
+        except (sqlite3.Error, OSError) as e:
+            if getattr(e, "sqlite_errorname", None) == "SQLITE_BUSY":
+                logger.debug(f"Message statuses in '{path}' are still used by another consumer")
+                continue
+            logger.error(f"Failed to merge message statuses from '{path}'")
+            logger.error(str(e))
+            continue
+        logger.debug(f"{count} message statuses were merged from '{path}'")
+
+
+async def run(shard: Optional[Shard] = None):
+    shard = shard or Shard()
+    logger.debug(f"Consumer runs shard {shard}")
+    await http_clients.start()
+    # Shards running on one host expose metrics on consecutive ports
+    metrics_server = await start_metrics_server(
+        METRICS_PORT and METRICS_PORT + shard.index, routes=[web.post("/deliver", request_delivery)]
+    )
+    status_buffer = StatusUpdateBuffer(
+        send_bulk=DirectManager.update_messages_status,
+        send_single=DirectManager.update_message_status_by_update,
+        path=shard.get_path(STATUS_BUFFER_PATH),
+        max_size=STATUS_BUFFER_MAX_SIZE,
+        flush_interval=STATUS_BUFFER_FLUSH_INTERVAL,
+    )
+    status_buffer.start()
+    try:
+        await main(status_buffer, shard)
+    finally:
+        await status_buffer.stop()
+        await http_clients.close()
+        shutdown_executor()
+        if metrics_server is not None:
+            await metrics_server.stop()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run(parse_shard_args("Sends generated messages of active bloggers")))
@@ -1,9 +1,16 @@
-import sentry_sdk
+from contextlib import asynccontextmanager
+
 import uvicorn
-from api.direct_handler import direct_router
+from api.direct_handler import direct_jobs, direct_router
 from api.service import service_router
+from api.webhooks import webhook_processor, webhook_router
 from base.exceptions import APIException, ErrorResponse
-from configs import APP_PORT, SENTRY_DSN
+from base.executors import shutdown_executor
+from base.http import http_clients
+from base.sentry import init_sentry
+from configs import (
+    APP_PORT,
+)
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.routing import APIRouter
@@ -12,19 +19,22 @@ from fastapi.routing import APIRouter
 # BLOCK WITH API ROUTES #
 #########################
 
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await http_clients.start()
+    webhook_processor.start()
+    yield
+    await direct_jobs.stop()
+    await webhook_processor.stop()
+    await http_clients.close()
+    shutdown_executor()
+
+
 # create instance of the app
-app = FastAPI(title="PYGMA Direct Communication service")
-
-sentry_sdk.init(
-    dsn=SENTRY_DSN,
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
+app = FastAPI(title="PYGMA Direct Communication service", lifespan=lifespan)
+
+init_sentry()
 
 
 # exceptions
@@ -37,7 +47,7 @@ async def api_exception_handler(_: Request, exc: APIException):
             error_code=exc.error_code,
             message=exc.message,
             details=exc.detail,
-        ).model_dump(),
+        ).dict(),
     )
 
 
@@ -46,6 +56,7 @@ main_api_router = APIRouter()
 
 # set routes to the app instance
 main_api_router.include_router(direct_router, prefix="/v1/api/direct", tags=["Direct"])
+main_api_router.include_router(webhook_router, prefix="/v1/api/webhooks", tags=["Webhooks"])
 main_api_router.include_router(service_router, tags=["service"])
 app.include_router(main_api_router)
 
@@ -1,90 +1,253 @@
 import asyncio
-from typing import Optional
+import hashlib
+import json
+import sys
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Optional, TypeVar
 
-import aiohttp
 from api.schemas import (
+    BloggersResponse,
+    BloggersWithGeneratedMessagesResponse,
     DataBlogger,
     DataBloggerWithGeneratedMessages,
     DataGeneratedMessage,
     DataThread,
+    DataThreadMessage,
     DataThreadRequest,
+    GeneratedMessageStatusUpdate,
+    ThreadsResponse,
+    WrapperResponse,
+)
+from base.batching import MicroBatcher
+from base.cache import LRUCache
+from base.fingerprints import thread_fingerprints
+from base.http import http_clients
+from base.metrics import (
+    ml_answer_cache_lookups,
+    ml_generations,
+    ml_generations_avoided,
+    threads_fetched,
+    threads_saved,
+)
+from base.resilience import CircuitBreakers, CircuitOpenError, retry
+from base.serialization import dump_model
+from base.singleflight import SingleFlight
+from base.streaming import iter_json_array
+from base.watermarks import watermarks
+from configs import (
+    ACCOUNT_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    ACCOUNT_CIRCUIT_BREAKER_RESET_TIMEOUT,
+    AUTH_SERVICE_HOST,
+    ML_ANSWERS_CACHE_SIZE,
+    ML_ANSWERS_CACHE_TTL,
+    ML_BATCH_MAX_WAIT,
+    ML_BATCH_SIZE,
+    ML_FREQUENCY_PENALTY,
+    ML_HISTORY_MAX_CHARS,
+    ML_HISTORY_MAX_TURNS,
+    ML_HISTORY_MERGE_SAME_SENDER,
+    ML_MAX_CONCURRENCY,
+    ML_MAX_TOKENS,
+    ML_PENDING_ANSWERS_CACHE_SIZE,
+    ML_PENDING_ANSWERS_TTL,
+    ML_PRESENCE_PENALTY,
+    ML_SERVICE_HOST,
+    ML_TEMPERATURE,
+    ML_TOP_P,
+    THREAD_FINGERPRINTS_ENABLED,
+    THREADS_SYNC_MODE,
+    WRAPPER_PAGE_SIZE,
+    WRAPPER_SERVICE_HOST,
+    WRAPPER_STREAM_CHUNK_SIZE,
 )
-from backends.facebook import FacebookBackend
-from backends.instagrapi import InstagrapiBackend
-from base.exceptions import APIException, ErrorCode
-from configs import AUTH_SERVICE_HOST, ML_SERVICE_HOST, WRAPPER_SERVICE_HOST
-from fastapi import status
-from instagrapi.exceptions import ChallengeRequired
 from loguru import logger
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from backends.facebook import FacebookBackend
+    from backends.instagrapi import InstagrapiBackend
+
+M = TypeVar("M", bound=BaseModel)
+
+GENERATION_SETTINGS = {
+    "temperature": ML_TEMPERATURE,
+    "max_tokens": ML_MAX_TOKENS,
+    "top_p": ML_TOP_P,
+    "frequency_penalty": ML_FREQUENCY_PENALTY,
+    "presence_penalty": ML_PRESENCE_PENALTY,
+}
+
+
+def get_challenge_errors() -> tuple[type[Exception], ...]:
+    """ChallengeRequired can only be raised once instagrapi has been loaded by its backend"""
+    exceptions = sys.modules.get("instagrapi.exceptions")
+    return (exceptions.ChallengeRequired,) if exceptions else ()
+
+
+def get_ml_service_error(message: str) -> Exception:
+    # Imported on failure only, so the workers don't load FastAPI
+    from base.exceptions import APIException, ErrorCode
+    from fastapi import status
+
+    return APIException(
+        error_code=ErrorCode.ml_service_getting_generated_text,
+        status_code=status.HTTP_400_BAD_REQUEST,
+        message=message,
+    )
 
 
 class DirectManager:
     @staticmethod
     async def get_instagram_backend(
         blogger: DataBlogger,
-    ) -> InstagrapiBackend | FacebookBackend:
+    ) -> "InstagrapiBackend | FacebookBackend":
+        """Backends are imported on first use, so a deployment only loads the client libraries it needs"""
         if blogger.can_use_official_graph_api:
+            from backends.facebook import FacebookBackend
+
             return FacebookBackend(
                 access_token=blogger.facebook_page_access_token,
                 page_id=blogger.facebook_page_id,
             )
         else:
+            from backends.instagrapi import InstagrapiBackend
+
             return InstagrapiBackend(
                 session_url=f"{AUTH_SERVICE_HOST}/api/v1/session",
                 instagram_login=blogger.instagram_login,
             )
 
     @staticmethod
+    @retry()
     async def get_active_bloggers() -> list[Optional[DataBlogger]]:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{WRAPPER_SERVICE_HOST}/v1/api/blogger/get-active-bloggers") as response:
-                response = await response.json()
+        async with http_clients.wrapper.get(f"{WRAPPER_SERVICE_HOST}/v1/api/blogger/get-active-bloggers") as response:
+            response.raise_for_status()
+            return BloggersResponse.parse_raw(await response.read()).data
 
-        return [DataBlogger(**item) for item in response["data"]]
+    @staticmethod
+    def iter_active_bloggers() -> AsyncIterator[Optional[DataBlogger]]:
+        return DirectManager.iter_wrapper_list(
+            f"{WRAPPER_SERVICE_HOST}/v1/api/blogger/get-active-bloggers", BloggersResponse, DataBlogger
+        )
+
+    @staticmethod
+    async def iter_wrapper_list(
+        url: str, response_model: type[WrapperResponse], item_model: type[M]
+    ) -> AsyncIterator[Optional[M]]:
+        """
+        Yields the items of a wrapper list endpoint as they arrive: page by page when WRAPPER_PAGE_SIZE is set,
+        otherwise parsed one by one from the body of a single response while it is being received.
+        """
+        if WRAPPER_PAGE_SIZE:
+            cursor = None
+            while True:
+                page = await DirectManager.get_wrapper_page(url, response_model, cursor)
+                for item in page.data:
+                    yield item
+                cursor = page.next_cursor
+                if not cursor or not page.data:
+                    return
+
+        async with http_clients.wrapper.get(url) as response:
+            response.raise_for_status()
+            async for item in iter_json_array(response.content, "data", WRAPPER_STREAM_CHUNK_SIZE):
+                yield None if item is None else item_model.parse_obj(item)
+
+    @staticmethod
+    @retry()
+    async def get_wrapper_page(
+        url: str, response_model: type[WrapperResponse], cursor: Optional[str] = None
+    ) -> WrapperResponse:
+        params = {"limit": WRAPPER_PAGE_SIZE}
+        if cursor:
+            params["cursor"] = cursor
+        async with http_clients.wrapper.get(url, params=params) as response:
+            response.raise_for_status()
+            return response_model.parse_raw(await response.read())
 
     async def get_threads_and_save_by_blogger(self, blogger: DataBlogger) -> Optional[list[Optional[DataThread]]]:
+        threads = await self.get_threads_by_blogger(blogger)
+        if threads:
+            return await self.save_threads(blogger, threads)
+
+    async def get_threads_by_blogger(self, blogger: DataBlogger) -> Optional[list[Optional[DataThreadRequest]]]:
+        """
+        Threads to sync in the polling cycle of the publisher: fetched since the blogger watermark in incremental
+        sync mode, without the threads whose fingerprint this process already committed
+        """
+        since = watermarks.get(blogger.id) if THREADS_SYNC_MODE == "incremental" else None
+        threads = await self.fetch_threads_by_blogger(blogger, since)
+        if threads and THREAD_FINGERPRINTS_ENABLED:
+            threads = thread_fingerprints.filter_changed(blogger.id, threads)
+            logger.debug(f"Count changed threads: {len(threads)}. Blogger: {blogger.instagram_login}")
+        if not threads:
+            logger.debug(f"No threads for saving. Blogger: {blogger.instagram_login}")
+        return threads
+
+    async def fetch_threads_by_blogger(
+        self, blogger: DataBlogger, since: Optional[float] = None
+    ) -> Optional[list[Optional[DataThreadRequest]]]:
         logger.debug(f"Trying get thread for instagram login: {blogger.instagram_login}")
         try:
-            threads: list[Optional[DataThreadRequest]] = await self.get_raw_threads_by_blogger(blogger)
+            with instagram_accounts_breakers.get(blogger.instagram_login):
+                threads: list[Optional[DataThreadRequest]] = await self.get_raw_threads_by_blogger(blogger, since)
+        except CircuitOpenError as e:
+            logger.debug(f"Skipping instagram login: {blogger.instagram_login}. {e}")
+            return
         except RuntimeError:
             return
-        except ChallengeRequired as e:
+        except get_challenge_errors() as e:
             logger.error(f"Error while getting threads for instagram login: {blogger.instagram_login}")
             logger.error(str(e))
             return
 
         logger.debug(f"Count threads for saving: {len(threads)}. Blogger: {blogger.instagram_login}")
-        if threads:
-            threads_for_save: list[dict] = await self.format_raw_threads(threads)
-            logger.debug(f"Trying save threads. Blogger: {blogger.instagram_login}")
-            result: list[Optional[DataThread]] = await self.save_threads_by_blogger(blogger, threads_for_save)
-            logger.debug(f"Threads were successfully saved. Blogger: {blogger.instagram_login}")
-            return result
+        threads_fetched.inc(len(threads))
+        return threads
 
-        logger.debug(f"No threads for saving. Blogger: {blogger.instagram_login}")
+    async def save_threads(
+        self, blogger: DataBlogger, threads: list[DataThreadRequest], update_watermark: bool = True
+    ) -> list[Optional[DataThread]]:
+        threads_for_save: list[dict] = await self.format_raw_threads(threads)
+        logger.debug(f"Trying save threads. Blogger: {blogger.instagram_login}")
+        result: list[Optional[DataThread]] = await self.save_threads_by_blogger(blogger, threads_for_save)
+        logger.debug(f"Threads were successfully saved. Blogger: {blogger.instagram_login}")
+        threads_saved.inc(len(threads))
+        if update_watermark and THREADS_SYNC_MODE == "incremental":
+            watermarks.set(blogger.id, self.get_threads_watermark(threads))
+        return result
 
-    async def get_raw_threads_by_blogger(self, blogger: DataBlogger) -> list[Optional[DataThreadRequest]]:
+    async def get_raw_threads_by_blogger(
+        self, blogger: DataBlogger, since: Optional[float] = None
+    ) -> list[Optional[DataThreadRequest]]:
         instagram_backend = await self.get_instagram_backend(blogger)
         logger.debug(f"Blogger: '{blogger.instagram_login}' uses {instagram_backend.__class__.__name__}")
-        threads = await instagram_backend.get_all_threads()
+        threads = await instagram_backend.get_all_threads(since=since)
         return threads
 
     @staticmethod
+    def get_threads_watermark(threads: list[DataThreadRequest]) -> float:
+        """Returns the creation time of the newest message among the threads"""
+        return max(
+            (message.created_at for thread in threads for message in thread.messages),
+            default=float("-inf"),
+        )
+
+    @staticmethod
+    @retry()
     async def save_threads_by_blogger(blogger: DataBlogger, threads_for_save: list[dict]) -> list[Optional[DataThread]]:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads",
-                json={"blogger_id": blogger.id, "threads": threads_for_save},
-            ) as response:
-                response.raise_for_status()
-                response = await response.json()
-                return [DataThread(**item) for item in response["data"]]
+        async with http_clients.wrapper.post(
+            f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads",
+            json={"blogger_id": blogger.id, "threads": threads_for_save},
+        ) as response:
+            response.raise_for_status()
+            return ThreadsResponse.parse_raw(await response.read()).data
 
     @staticmethod
     async def format_raw_threads(threads: list[DataThreadRequest]) -> list[dict]:
         threads_for_save = []
         for thread in threads:
-            threads_for_save.append(thread.dict())
+            threads_for_save.append(dump_model(thread))
 
         return threads_for_save
 
@@ -99,50 +262,175 @@ class DirectManager:
     async def get_generated_answer_based_on_thread_and_save(
         self, thread: DataThread
     ) -> Optional[list[DataGeneratedMessage]]:
+        generated_message = await self.get_generated_answer_for_thread(thread)
+        if generated_message:
+            return await self.save_generated_answer_for_thread(thread, generated_message)
+
+    @staticmethod
+    def has_unsent_generated_answer(thread: DataThread) -> bool:
+        """
+        Uses the wrapper flag when it is there. Otherwise a thread is pending from saving its answer
+        until a blogger message newer than that shows up, which means the consumer sent it,
+        or until `refresh_pending_answers` finds the answer isn't waiting for delivery anymore.
+        """
+        if thread.has_unsent_generated_message is not None:
+            return thread.has_unsent_generated_message
+
+        saved_at = pending_answers.get(thread.id)
+        if saved_at is None:
+            return False
+        if any(message.sender == "blogger" and message.created_at > saved_at for message in thread.messages or []):
+            pending_answers.pop(thread.id)
+            return False
+        return True
+
+    @staticmethod
+    async def refresh_pending_answers() -> None:
+        """
+        Drops the pending answers that the wrapper no longer has waiting for delivery. The consumer sent them
+        or failed to, either way the thread can be answered again without waiting for the TTL.
+        """
+        if not len(pending_answers):
+            return
+        started_at = time.time()
+        unsent_thread_ids = set()
+        async for blogger in DirectManager.iter_messages_for_publishing():
+            if blogger is not None:
+                unsent_thread_ids.update(message.thread_id for message in blogger.messages or [])
+        for thread_id, saved_at in pending_answers.items():
+            # Answers saved after the list was requested may be missing from it
+            if saved_at < started_at and thread_id not in unsent_thread_ids:
+                pending_answers.pop(thread_id)
+
+    async def get_generated_answer_for_thread(self, thread: DataThread) -> Optional[str]:
+        if self.has_unsent_generated_answer(thread):
+            ml_generations_avoided.inc()
+            logger.debug(f"Thread with id '{thread.id}' already has unsent generated message")
+            return
+
         logger.debug(f"Trying get generated answer for thread id: '{thread.id}'")
 
         formatted_thread = await self.format_messages_for_getting_generated_answer(thread)
         if formatted_thread:
-            generated_message: str = await self.get_generated_answer_based_on_thread(formatted_thread)
+            generated_message: str = await self.get_generated_answer(formatted_thread)
             if generated_message:
                 logger.debug(f"Got generated message for thread id: '{thread.id}'")
-                logger.debug("Trying save generated message")
-                result: Optional[DataGeneratedMessage] = await self.save_generated_answer(generated_message, thread.id)
-                logger.debug(
-                    "Generated message was successfully saved"
-                    if result
-                    else f"Thread with id '{thread.id}' already has unsent generated message"
-                )
-                return result
+                return generated_message
+
+    async def save_generated_answer_for_thread(
+        self, thread: DataThread, generated_message: str
+    ) -> Optional[DataGeneratedMessage]:
+        logger.debug("Trying save generated message")
+        result: Optional[DataGeneratedMessage] = await self.save_generated_answer(generated_message, thread.id)
+        # Either way the thread now has an answer waiting for the consumer, the wrapper flag tells it when it is there
+        if thread.has_unsent_generated_message is None:
+            pending_answers.set(thread.id, time.time())
+        logger.debug(
+            "Generated message was successfully saved"
+            if result
+            else f"Thread with id '{thread.id}' already has unsent generated message"
+        )
+        return result
 
     @staticmethod
+    def get_generated_answer_key(data: dict) -> str:
+        """Canonical hash of the dialogs and generation settings of a formatted thread"""
+        payload = {"dialogs": data["data"]["dialogs"], "generation_settings": data["config"]["generation_settings"]}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    async def get_generated_answer(self, data: dict) -> str:
+        """
+        Returns the cached answer for the same dialog if there is one.
+        Otherwise concurrent requests for the same dialog share one ML call.
+        """
+        key = self.get_generated_answer_key(data)
+        generated_message = ml_answers.get(key)
+        if generated_message is not None:
+            ml_answer_cache_lookups.inc(result="hit")
+            return generated_message
+
+        ml_answer_cache_lookups.inc(result="miss")
+        generated_message = await ml_requests.do(key, lambda: self.request_generated_answer(data))
+        ml_answers.set(key, generated_message)
+        return generated_message
+
+    async def request_generated_answer(self, data: dict) -> str:
+        if ML_BATCH_SIZE > 1:
+            generated_message = await ml_batcher.submit(data, group=json.dumps(data["config"], sort_keys=True))
+        else:
+            generated_message = await self.get_generated_answer_based_on_thread(data)
+        ml_generations.inc()
+        return generated_message
+
+    @staticmethod
+    @retry()
+    async def get_generated_answers_based_on_threads(batch: list[dict]) -> list[str]:
+        """Sends the dialogs of several formatted threads in one request, texts are returned in the same order"""
+        data = {
+            "data": {"dialogs": [dialog for item in batch for dialog in item["data"]["dialogs"]]},
+            "config": batch[0]["config"],
+        }
+        async with ml_semaphore, http_clients.ml.post(f"{ML_SERVICE_HOST}/predict", json=data) as response:
+            response.raise_for_status()
+            response = await response.json()
+        texts = response.get("texts") or []
+        if len(texts) == len(data["data"]["dialogs"]) and all(texts):
+            return texts
+
+        raise get_ml_service_error("ML service didn't give generated text for every dialog")
+
+    @staticmethod
+    @retry()
     async def get_generated_answer_based_on_thread(data) -> str:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{ML_SERVICE_HOST}/predict", json=data) as response:
-                response.raise_for_status()
-                response = await response.json()
+        async with ml_semaphore, http_clients.ml.post(f"{ML_SERVICE_HOST}/predict", json=data) as response:
+            response.raise_for_status()
+            response = await response.json()
         texts = response.get("texts")
         if texts:
             return texts[0]
 
-        raise APIException(
-            error_code=ErrorCode.ml_service_getting_generated_text,
-            status_code=status.HTTP_400_BAD_REQUEST,
-            message="ML service didn't give generated text",
-        )
+        raise get_ml_service_error("ML service didn't give generated text")
 
     @staticmethod
+    @retry()
     async def save_generated_answer(message: str, thread_id: int) -> Optional[DataGeneratedMessage]:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads/generated-message",
-                json={"thread_id": thread_id, "message": message},
-            ) as response:
-                response.raise_for_status()
-                response = await response.json()
-                data = response.get("data")
-                if data:
-                    return DataGeneratedMessage(**data)
+        async with http_clients.wrapper.post(
+            f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads/generated-message",
+            json={"thread_id": thread_id, "message": message},
+        ) as response:
+            response.raise_for_status()
+            response = await response.json()
+            data = response.get("data")
+            if data:
+                return DataGeneratedMessage(**data)
+
+    @staticmethod
+    def format_dialog_history(messages: list[DataThreadMessage]) -> list[dict]:
+        """
+        Turns messages into dialog turns, keeping only the newest ones within ML_HISTORY_MAX_TURNS
+        and ML_HISTORY_MAX_CHARS. Messages are walked from the newest, so long threads stop early.
+        """
+        turns: list[list[str]] = []  # [role, text], newest first
+        size = 0
+        for message in reversed(messages):
+            if not message.text:
+                continue
+            role = "bot" if message.sender == "blogger" else "user"
+            merge = ML_HISTORY_MERGE_SAME_SENDER and turns and turns[-1][0] == role
+            if not merge and ML_HISTORY_MAX_TURNS and len(turns) >= ML_HISTORY_MAX_TURNS:
+                break
+            if ML_HISTORY_MAX_CHARS and size + len(message.text) > ML_HISTORY_MAX_CHARS:
+                break
+            size += len(message.text)
+            if merge:
+                turns[-1][1] = f"{message.text}\n{turns[-1][1]}"
+            else:
+                turns.append([role, message.text])
+
+        return [
+            {"bot": text if role == "bot" else "", "user": text if role == "user" else ""}
+            for role, text in reversed(turns)
+        ]
 
     @staticmethod
     async def format_messages_for_getting_generated_answer(thread: DataThread):
@@ -151,62 +439,93 @@ class DirectManager:
             last_message_text = sorted_messages[-1].text
             if last_message_text and sorted_messages[-1].sender != "blogger":
                 other_messages = sorted_messages[:-1]
-
-                dialog_history = []
-                for message in other_messages:
-                    if not message.text:
-                        continue
-                    dialog = {}
-                    if message.sender == "blogger":
-                        dialog["bot"] = message.text
-                        dialog["user"] = ""
-                    else:
-                        dialog["bot"] = ""
-                        dialog["user"] = message.text
-                    dialog_history.append(dialog)
+                if ML_HISTORY_MERGE_SAME_SENDER:
+                    # The user's messages after the last answer are answered together
+                    while other_messages and other_messages[-1].sender != "blogger":
+                        if other_messages[-1].text:
+                            last_message_text = f"{other_messages[-1].text}\n{last_message_text}"
+                        other_messages = other_messages[:-1]
 
                 return {
                     "data": {
                         "dialogs": [
                             {
                                 "user": last_message_text,
-                                "dialog_history": dialog_history,
+                                "dialog_history": DirectManager.format_dialog_history(other_messages),
                             }
                         ]
                     },
-                    "config": {
-                        "generation_settings": {
-                            "temperature": 0.7,
-                            "max_tokens": 1000,
-                            "top_p": 1,
-                            "frequency_penalty": 0,
-                            "presence_penalty": 0,
-                        }
-                    },
+                    "config": {"generation_settings": GENERATION_SETTINGS},
                 }
 
     @staticmethod
+    def iter_messages_for_publishing() -> AsyncIterator[Optional[DataBloggerWithGeneratedMessages]]:
+        return DirectManager.iter_wrapper_list(
+            f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads/generated-messages",
+            BloggersWithGeneratedMessagesResponse,
+            DataBloggerWithGeneratedMessages,
+        )
+
+    @staticmethod
+    @retry()
     async def get_messages_for_publishing() -> list[Optional[DataBloggerWithGeneratedMessages]]:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads/generated-messages") as response:
-                response.raise_for_status()
-                response = await response.json()
-                return [DataBloggerWithGeneratedMessages(**item) for item in response["data"]]
+        async with http_clients.wrapper.get(
+            f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads/generated-messages"
+        ) as response:
+            response.raise_for_status()
+            return BloggersWithGeneratedMessagesResponse.parse_raw(await response.read()).data
 
     async def send_message(self, message: DataGeneratedMessage, blogger: DataBloggerWithGeneratedMessages) -> None:
         instagram_backend = await self.get_instagram_backend(blogger)
         logger.debug(f"Blogger: '{blogger.instagram_login}' uses {instagram_backend.__class__.__name__}")
-        return await instagram_backend.send_message(message)
+        # Never retried, a send that failed after reaching Instagram could deliver the message twice
+        with instagram_accounts_breakers.get(blogger.instagram_login):
+            return await instagram_backend.send_message(message)
 
     @staticmethod
     async def update_message_status(
         message: DataGeneratedMessage, status: str, error: Optional[str] = None
     ) -> DataGeneratedMessage:
-        async with aiohttp.ClientSession() as session:
-            async with session.patch(
-                f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads/generated-messages",
-                json={"id": message.id, "status": status, "error": error},
-            ) as response:
-                response.raise_for_status()
-                response = await response.json()
-                return DataGeneratedMessage(**response["data"])
+        return await DirectManager.update_message_status_by_update(
+            GeneratedMessageStatusUpdate(id=message.id, status=status, error=error)
+        )
+
+    @staticmethod
+    @retry()
+    async def update_message_status_by_update(update: GeneratedMessageStatusUpdate) -> DataGeneratedMessage:
+        async with http_clients.wrapper.patch(
+            f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads/generated-messages",
+            json=update.dict(),
+        ) as response:
+            response.raise_for_status()
+            response = await response.json()
+            return DataGeneratedMessage(**response["data"])
+
+    @staticmethod
+    @retry()
+    async def update_messages_status(updates: list[GeneratedMessageStatusUpdate]) -> None:
+        async with http_clients.wrapper.patch(
+            f"{WRAPPER_SERVICE_HOST}/v1/api/direct/threads/generated-messages/bulk",
+            json={"messages": [update.dict() for update in updates]},
+        ) as response:
+            response.raise_for_status()
+
+
+instagram_accounts_breakers = CircuitBreakers(
+    "instagram_account", ACCOUNT_CIRCUIT_BREAKER_FAILURE_THRESHOLD, ACCOUNT_CIRCUIT_BREAKER_RESET_TIMEOUT
+)
+
+# Generated answers by dialog hash
+ml_answers: LRUCache[str, str] = LRUCache(maxsize=ML_ANSWERS_CACHE_SIZE, ttl=ML_ANSWERS_CACHE_TTL)
+ml_requests = SingleFlight()
+# Thread id -> time its generated answer was saved, until it is sent
+pending_answers: LRUCache[int, float] = LRUCache(maxsize=ML_PENDING_ANSWERS_CACHE_SIZE, ttl=ML_PENDING_ANSWERS_TTL)
+ml_semaphore = asyncio.Semaphore(ML_MAX_CONCURRENCY)
+
+ml_batcher: MicroBatcher[dict, str] = MicroBatcher(
+    handle_batch=DirectManager.get_generated_answers_based_on_threads,
+    handle_single=DirectManager.get_generated_answer_based_on_thread,
+    max_size=ML_BATCH_SIZE,
+    max_wait=ML_BATCH_MAX_WAIT,
+    name="ML batcher",
+)
@@ -1,69 +1,210 @@
 import asyncio
-from typing import Optional
+import time
+from typing import AsyncIterator, Optional
 
-import sentry_sdk
-from aiohttp import ClientConnectorError, ClientResponseError
-from api.schemas import DataBlogger, DataGeneratedMessage, DataThread
-from configs import SENTRY_DSN
+from api.schemas import (
+    DataBlogger,
+    DataGeneratedMessage,
+    DataThread,
+    DataThreadRequest,
+)
+from base.executors import shutdown_executor
+from base.fingerprints import thread_fingerprints
+from base.http import http_clients
+from base.metrics import start_metrics_server
+from base.pipeline import Pipeline, Stage
+from base.resilience import UPSTREAM_ERRORS
+from base.resources import ResourceMonitor
+from base.scheduler import AdaptivePollScheduler
+from base.sentry import init_sentry
+from base.sharding import Shard, parse_shard_args
+from base.watermarks import watermarks
+from configs import (
+    METRICS_PORT,
+    POLL_BACKOFF_FACTOR,
+    POLL_MAX_INTERVAL,
+    POLL_MIN_INTERVAL,
+    PUBLISHER_BLOGGERS_REFRESH_INTERVAL,
+    PUBLISHER_FETCH_WORKERS,
+    PUBLISHER_GENERATE_WORKERS,
+    PUBLISHER_MAX_BLOGGERS_PER_CYCLE,
+    PUBLISHER_QUEUE_SIZE,
+    PUBLISHER_SAVE_ANSWER_WORKERS,
+    PUBLISHER_SAVE_WORKERS,
+    WEBHOOKS_ENABLED,
+    WEBHOOK_RECONCILIATION_INTERVAL,
+)
 from loguru import logger
 from manager import DirectManager
 
-sentry_sdk.init(
-    dsn=SENTRY_DSN,
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
+init_sentry()
+
+
+def build_pipeline(manager: DirectManager, scheduler: Optional[AdaptivePollScheduler] = None) -> Pipeline:
+    """
+    blogger -> fetch threads -> save threads -> generate answer (per thread) -> save answer.
+    A blogger's threads go on to generation as soon as they are saved, without waiting for the other bloggers.
+    The scheduler, when given, learns after every fetch whether the blogger had new threads.
+    """
+
+    async def fetch_threads(blogger: DataBlogger) -> Optional[tuple[DataBlogger, list[DataThreadRequest]]]:
+        threads = None
+        try:
+            threads = await manager.get_threads_by_blogger(blogger)
+        finally:
+            if scheduler is not None:
+                scheduler.record(blogger.id, active=bool(threads))
+        if threads:
+            return blogger, threads
+
+    async def save_threads(item: tuple[DataBlogger, list[DataThreadRequest]]) -> list[tuple[DataBlogger, DataThread]]:
+        blogger, threads = item
+        saved_threads = await manager.save_threads(blogger, threads)
+        return [(blogger, thread) for thread in saved_threads if thread is not None]
+
+    async def generate_answer(item: tuple[DataBlogger, DataThread]) -> Optional[tuple[DataBlogger, DataThread, str]]:
+        blogger, thread = item
+        generated_message = await manager.get_generated_answer_for_thread(thread)
+        if generated_message:
+            return blogger, thread, generated_message
+        # Nothing to answer, the thread is done until it changes
+        thread_fingerprints.commit(blogger.id, thread)
+
+    async def save_answer(item: tuple[DataBlogger, DataThread, str]) -> Optional[DataGeneratedMessage]:
+        blogger, thread, generated_message = item
+        result = await manager.save_generated_answer_for_thread(thread, generated_message)
+        thread_fingerprints.commit(blogger.id, thread)
+        return result
+
+    return Pipeline(
+        [
+            Stage("fetch_threads", fetch_threads, workers=PUBLISHER_FETCH_WORKERS, queue_size=PUBLISHER_QUEUE_SIZE),
+            Stage(
+                "save_threads",
+                save_threads,
+                workers=PUBLISHER_SAVE_WORKERS,
+                queue_size=PUBLISHER_QUEUE_SIZE,
+                fan_out=True,
+            ),
+            Stage(
+                "generate_answer",
+                generate_answer,
+                workers=PUBLISHER_GENERATE_WORKERS,
+                queue_size=PUBLISHER_QUEUE_SIZE,
+            ),
+            Stage(
+                "save_answer",
+                save_answer,
+                workers=PUBLISHER_SAVE_ANSWER_WORKERS,
+                queue_size=PUBLISHER_QUEUE_SIZE,
+            ),
+        ],
+        name="publisher",
+    )
+
 
+def get_poll_min_interval(blogger: DataBlogger) -> Optional[float]:
+    # Webhooks deliver the messages of Graph API bloggers, polling them only reconciles missed events
+    if WEBHOOKS_ENABLED and blogger.can_use_official_graph_api:
+        return WEBHOOK_RECONCILIATION_INTERVAL
+
+
+async def main(shard: Optional[Shard] = None):
+    shard = shard or Shard()
+    scheduler = AdaptivePollScheduler(POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_BACKOFF_FACTOR)
+    bloggers: dict[int, DataBlogger] = {}
+    refresh_at = 0.0
+
+    async def get_due_bloggers(manager: DirectManager, refresh: bool) -> AsyncIterator[DataBlogger]:
+        """
+        Yields the bloggers due for polling, at most PUBLISHER_MAX_BLOGGERS_PER_CYCLE of them.
+        On a refresh the active bloggers are streamed from the wrapper and the due ones are yielded on arrival.
+        """
+        nonlocal bloggers
+        count = 0
+        if refresh:
+            active_bloggers: dict[int, DataBlogger] = {}
+            try:
+                logger.debug("Trying to get active bloggers for save their threads")
+                async for blogger in manager.iter_active_bloggers():
+                    if blogger is None or not shard.owns(blogger.id):
+                        continue
+                    active_bloggers[blogger.id] = blogger
+                    scheduler.add(blogger.id, min_interval=get_poll_min_interval(blogger))
+                    if count < PUBLISHER_MAX_BLOGGERS_PER_CYCLE and scheduler.take(blogger.id):
+                        count += 1
+                        yield blogger
+                bloggers = active_bloggers
+                scheduler.retain(bloggers)
+            except UPSTREAM_ERRORS as e:
+                # Known bloggers keep being polled, the list is refreshed again on the next interval
+                logger.error("Error for getting active bloggers")
+                logger.error(str(e))
+                bloggers.update(active_bloggers)
+
+        for blogger_id in scheduler.pop_due(PUBLISHER_MAX_BLOGGERS_PER_CYCLE - count):
+            yield bloggers[blogger_id]
 
-async def main():
     while True:
         manager = DirectManager()
-        try:
-            logger.debug("Trying to get active bloggers for save their threads")
-            bloggers: list[Optional[DataBlogger]] = await manager.get_active_bloggers()
-        except (ClientResponseError, ClientConnectorError) as e:
-            logger.error("Error for getting active bloggers")
-            logger.error(str(e))
-            await asyncio.sleep(60)
-            continue
+        refresh = time.monotonic() >= refresh_at
+        if refresh:
+            refresh_at = time.monotonic() + PUBLISHER_BLOGGERS_REFRESH_INTERVAL
 
-        try:
-            logger.debug(f"Count bloggers for saving threads: {len(bloggers)}")
-            bloggers_threads: Optional[list[Optional[DataThread]]] = await asyncio.gather(
-                *(manager.get_threads_and_save_by_blogger(blogger) for blogger in bloggers)
-            )
-        except ClientResponseError as e:
-            logger.error("Error for getting and saving thread for bloggers")
-            logger.error(str(e))
-            await asyncio.sleep(60)
-            continue
+        if refresh:
+            try:
+                await manager.refresh_pending_answers()
+            except UPSTREAM_ERRORS as e:
+                logger.error("Error for refreshing pending answers")
+                logger.error(str(e))
 
-        try:
-            bloggers_with_new_messages: Optional[list[DataGeneratedMessage]] = await asyncio.gather(
-                *(
-                    manager.get_generated_answer_based_on_blogger_threads_and_save(blogger_threads)
-                    for blogger_threads in bloggers_threads
-                    if blogger_threads is not None
-                )
-            )
-            result = []
-            for blogger_with_new_messages in bloggers_with_new_messages:
-                result.extend([item for item in blogger_with_new_messages if item])
-
-            logger.debug(f"Count new messages for answering: {len(result)}")
-        except ClientResponseError as e:
-            logger.error("Error for getting and saving new generated answers")
-            logger.error(str(e))
-            await asyncio.sleep(60)
-            continue
-
-        await asyncio.sleep(60)
+        if refresh or scheduler.next_due_in() == 0:
+            pipeline = build_pipeline(manager, scheduler)
+            stats = None
+            try:
+                async with ResourceMonitor("publisher") as monitor:
+                    stats = await pipeline.run(get_due_bloggers(manager, refresh))
+            except UPSTREAM_ERRORS as e:
+                logger.error("Error for saving threads of bloggers")
+                logger.error(str(e))
+            if stats and stats[0].processed:
+                logger.debug(f"Count bloggers for saving threads: {stats[0].processed} of {len(bloggers)}")
+                pipeline.log_stats()
+                monitor.log()
+                logger.debug(f"Count new messages for answering: {stats[-1].emitted}")
+                logger.debug(f"Thread fingerprints: {thread_fingerprints.stats}")
+
+                watermarks.save()
+                thread_fingerprints.save()
+
+        # Sleep until the next blogger is due or the blogger list has to be refreshed
+        delay = refresh_at - time.monotonic()
+        next_due_in = scheduler.next_due_in()
+        if next_due_in is not None:
+            delay = min(delay, next_due_in)
+        await asyncio.sleep(max(delay, 1))
+
+
+async def run(shard: Optional[Shard] = None):
+    shard = shard or Shard()
+    logger.debug(f"Publisher runs shard {shard}")
+    watermarks.path = shard.get_path(watermarks.path)
+    watermarks.load()
+    thread_fingerprints.path = shard.get_path(thread_fingerprints.path)
+    thread_fingerprints.load()
+    await http_clients.start()
+    # Shards running on one host expose metrics on consecutive ports
+    metrics_server = await start_metrics_server(METRICS_PORT and METRICS_PORT + shard.index)
+    try:
+        await main(shard)
+    finally:
+        watermarks.save()
+        thread_fingerprints.save()
+        await http_clients.close()
+        shutdown_executor()
+        if metrics_server is not None:
+            await metrics_server.stop()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run(parse_shard_args("Saves threads of active bloggers and generates answers for them")))
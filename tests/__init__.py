@@ -0,0 +1,16 @@
+import os
+
+# Settings configs requires, no upstream is reached by the tests
+TEST_ENV = {
+    "APP_PORT": "0",
+    "SENTRY_DSN": "",
+    "AUTH_SERVICE_HOST": "http://127.0.0.1",
+    "WRAPPER_SERVICE_HOST": "http://127.0.0.1",
+    "ML_SERVICE_HOST": "http://127.0.0.1",
+    "STATUS_BUFFER_PATH": "",
+    "FACEBOOK_APP_SECRET": "test-app-secret",
+    "FACEBOOK_WEBHOOK_VERIFY_TOKEN": "test-verify-token",
+}
+
+for name, value in TEST_ENV.items():
+    os.environ.setdefault(name, value)
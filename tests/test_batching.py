@@ -0,0 +1,49 @@
+import asyncio
+import unittest
+
+from base.batching import MicroBatcher
+
+
+class FakeHandler:
+    def __init__(self, fail_batch: bool = False) -> None:
+        self.fail_batch = fail_batch
+        self.batches: list[list[int]] = []
+        self.singles: list[int] = []
+
+    async def handle_batch(self, items: list[int]) -> list[int]:
+        self.batches.append(items)
+        if self.fail_batch:
+            raise ValueError("batch failed")
+        return [item * 10 for item in items]
+
+    async def handle_single(self, item: int) -> int:
+        self.singles.append(item)
+        if item < 0:
+            raise ValueError("item failed")
+        return item * 10
+
+
+class MicroBatcherTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_full_batch_is_flushed_right_away(self):
+        handler = FakeHandler()
+        batcher = MicroBatcher(handler.handle_batch, handler.handle_single, max_size=2, max_wait=60)
+        results = await asyncio.wait_for(asyncio.gather(batcher.submit(1), batcher.submit(2)), 1)
+        self.assertEqual(results, [10, 20])
+        self.assertEqual(handler.batches, [[1, 2]])
+
+    async def test_batches_are_grouped_and_flushed_after_max_wait(self):
+        handler = FakeHandler()
+        batcher = MicroBatcher(handler.handle_batch, handler.handle_single, max_size=10, max_wait=0.01)
+        results = await asyncio.gather(batcher.submit(1, "a"), batcher.submit(2, "b"), batcher.submit(3, "a"))
+        self.assertEqual(results, [10, 20, 30])
+        # A batch of one item goes through the single handler
+        self.assertEqual(handler.batches, [[1, 3]])
+        self.assertEqual(handler.singles, [2])
+
+    async def test_failed_batch_falls_back_to_single_items(self):
+        handler = FakeHandler(fail_batch=True)
+        batcher = MicroBatcher(handler.handle_batch, handler.handle_single, max_size=2, max_wait=60)
+        results = await asyncio.gather(batcher.submit(1), batcher.submit(-1), return_exceptions=True)
+        self.assertEqual(results[0], 10)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(sorted(handler.singles), [-1, 1])
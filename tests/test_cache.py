@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from base import cache
+from base.cache import LRUCache
+from base.singleflight import SingleFlight
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        lru = LRUCache(maxsize=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        self.assertEqual(lru.get("a"), 1)
+        lru.set("c", 3)
+        self.assertEqual(lru.items(), [("a", 1), ("c", 3)])
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.stats, {"size": 2, "maxsize": 2, "hits": 1, "misses": 1})
+
+    def test_expired_entries_are_missing(self):
+        with mock.patch.object(cache.time, "monotonic", return_value=0.0) as monotonic:
+            lru = LRUCache(maxsize=2, ttl=10)
+            lru.set("a", 1)
+            monotonic.return_value = 10.0
+            self.assertIn("a", lru)
+            monotonic.return_value = 10.1
+            self.assertNotIn("a", lru)
+            self.assertEqual(len(lru), 0)
+
+
+class SingleFlightTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_are_coalesced(self):
+        calls = []
+
+        async def fetch() -> str:
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(3)))
+        self.assertEqual(results, ["result"] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(flight), 0)
+
+    async def test_cancelled_caller_does_not_cancel_the_call(self):
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def fetch() -> str:
+            started.set()
+            await asyncio.sleep(0.01)
+            return "result"
+
+        waiter = asyncio.create_task(flight.do("key", fetch))
+        await started.wait()
+        waiter.cancel()
+        self.assertEqual(await flight.do("key", fetch), "result")
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+from api.schemas import DataBloggerWithGeneratedMessages, DataGeneratedMessage
+from base.rate_limit import TokenBucket
+from base.status_buffer import StatusUpdateBuffer
+from consumer import DeliveryScheduler
+
+
+async def send(*_) -> None:
+    pass
+
+
+def make_blogger(blogger_id: int, *message_ids: int) -> DataBloggerWithGeneratedMessages:
+    messages = [
+        DataGeneratedMessage(
+            id=message_id,
+            thread_id=1,
+            text="hi",
+            status="generated",
+            recipient_instagram_username="user",
+        )
+        for message_id in message_ids
+    ]
+    return DataBloggerWithGeneratedMessages(
+        id=blogger_id,
+        instagram_login=f"blogger_{blogger_id}",
+        status="active",
+        can_use_official_graph_api=False,
+        messages=messages,
+    )
+
+
+class FakeManager:
+    def __init__(self) -> None:
+        self.sent: list[int] = []
+
+    async def send_message(self, message: DataGeneratedMessage, _) -> None:
+        self.sent.append(message.id)
+
+
+class DeliverySchedulerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.status_buffer = StatusUpdateBuffer(send, send, max_size=1000)
+        self.scheduler = DeliveryScheduler(self.status_buffer)
+        self.manager = FakeManager()
+        # Blogger 1 has a backlog at one message a minute, blogger 2 sends right away
+        self.scheduler._buckets[1] = TokenBucket(rate=1 / 60)
+        self.scheduler._buckets[2] = TokenBucket(rate=1000)
+        self.addAsyncCleanup(self.scheduler.stop)
+
+    async def test_slow_lane_does_not_hold_back_other_bloggers(self):
+        count = await asyncio.wait_for(
+            self.scheduler.deliver(self.manager, [make_blogger(1, 10, 11, 12), make_blogger(2, 20)]), 1
+        )
+        self.assertEqual(count, 2)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.manager.sent, [10, 20])
+        self.assertEqual(self.scheduler.running, 1)
+
+        # The next poll starts the other blogger again while the first lane is still busy
+        count = await self.scheduler.deliver(self.manager, [make_blogger(1, 10, 11, 12, 13), make_blogger(2, 20, 21)])
+        self.assertEqual(count, 1)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.manager.sent, [10, 20, 21])
+
+    async def test_stop_cancels_running_lanes(self):
+        await self.scheduler.deliver(self.manager, [make_blogger(1, 10, 11)])
+        await asyncio.sleep(0.1)
+        await self.scheduler.stop()
+        self.assertEqual(self.scheduler.running, 0)
+        self.assertEqual(self.manager.sent, [10])
@@ -0,0 +1,88 @@
+import time
+import unittest
+from unittest import mock
+
+from api.direct_handler import DirectJobs
+from api.schemas import DataBlogger, DataGeneratedMessage, DataThread, DataThreadRequest
+from base.fingerprints import thread_fingerprints
+from fastapi.testclient import TestClient
+from main import app
+from manager import DirectManager
+
+URL = "/v1/api/direct"
+
+BLOGGER = DataBlogger(
+    id=1,
+    instagram_login="blogger",
+    status="active",
+    can_use_official_graph_api=False,
+    facebook_page_id=None,
+    facebook_page_access_token=None,
+)
+
+
+def make_thread_request(thread_id: int) -> DataThreadRequest:
+    return DataThreadRequest(instagram_id_from_instagrapi=str(thread_id), thread_to_username="user", messages=[])
+
+
+def make_thread(thread_id: int) -> DataThread:
+    return DataThread(id=thread_id, instagram_id_from_instagrapi=str(thread_id), thread_to_username="user", messages=[])
+
+
+def make_answer(thread_id: int) -> DataGeneratedMessage:
+    return DataGeneratedMessage(
+        id=100 + thread_id, thread_id=thread_id, text="hi", status="new", recipient_instagram_username="user"
+    )
+
+
+class DirectJobsEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def wait_for_job(self, client: TestClient, job_id: str) -> dict:
+        for _ in range(100):
+            job = client.get(f"{URL}/jobs/{job_id}").json()
+            if job["status"] != "running":
+                return job
+            time.sleep(0.01)
+        self.fail(f"Job {job_id} didn't finish")
+
+    def test_unknown_job(self):
+        response = self.client.get(f"{URL}/jobs/unknown")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["error_code"], "direct.job_not_found")
+
+    def test_delivery_without_consumer_hosts(self):
+        with mock.patch("api.direct_handler.CONSUMER_HOSTS", []):
+            response = self.client.post(f"{URL}/bloggers/1/deliver")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["error_code"], "direct.delivery_disabled")
+
+    def test_thread_generation(self):
+        fetched = [make_thread_request(1), make_thread_request(2)]
+        saved = [make_thread(1), make_thread(2)]
+        with (
+            mock.patch.object(DirectJobs, "get_active_blogger", mock.AsyncMock(return_value=BLOGGER)),
+            mock.patch.object(DirectManager, "fetch_threads_by_blogger", mock.AsyncMock(return_value=fetched)) as fetch,
+            mock.patch.object(DirectManager, "save_threads", mock.AsyncMock(return_value=saved)),
+            mock.patch.object(
+                DirectManager,
+                "get_generated_answer_based_on_thread_and_save",
+                mock.AsyncMock(return_value=make_answer(2)),
+            ) as generate,
+            mock.patch.object(thread_fingerprints, "filter_changed") as filter_changed,
+            TestClient(app) as client,
+        ):
+            response = client.post(f"{URL}/bloggers/1/threads/2/generate")
+            self.assertEqual(response.status_code, 202)
+            job = self.wait_for_job(client, response.json()["id"])
+            self.assertEqual((job["status"], job["result"]), ("succeeded", {"generated_message_id": 102}))
+            # The whole inbox is fetched, threads aren't skipped by the publisher's fingerprints or watermark
+            fetch.assert_awaited_once_with(BLOGGER)
+            filter_changed.assert_not_called()
+            self.assertEqual(generate.await_args.args[0].id, 2)
+
+            response = client.post(f"{URL}/bloggers/1/threads/3/generate")
+            job = self.wait_for_job(client, response.json()["id"])
+            self.assertEqual(job["status"], "failed")
+            self.assertIn("Thread with id '3' wasn't found", job["error"])
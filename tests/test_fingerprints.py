@@ -0,0 +1,43 @@
+import unittest
+
+from api.schemas import DataThreadMessageRequest, DataThreadRequest
+from base.fingerprints import ThreadFingerprints
+
+
+def make_thread(thread_id: str, *message_ids: str) -> DataThreadRequest:
+    messages = [
+        DataThreadMessageRequest(
+            instagram_id_from_instagrapi=message_id,
+            created_at=index,
+            sender="external_user",
+            item_type="text",
+            text="hi",
+        )
+        for index, message_id in enumerate(message_ids)
+    ]
+    return DataThreadRequest(instagram_id_from_instagrapi=thread_id, thread_to_username="user", messages=messages)
+
+
+class ThreadFingerprintsTestCase(unittest.TestCase):
+    def test_only_committed_unchanged_threads_are_skipped(self):
+        fingerprints = ThreadFingerprints(maxsize=10)
+        first, second = make_thread("1", "a"), make_thread("2", "b")
+        self.assertEqual(fingerprints.filter_changed(1, [first, second]), [first, second])
+        fingerprints.commit(1, first)
+
+        # The second thread wasn't committed, e.g. its generation failed, so it is processed again
+        self.assertEqual(fingerprints.filter_changed(1, [first, second]), [second])
+        # Another blogger has its own fingerprints
+        self.assertEqual(fingerprints.filter_changed(2, [first]), [first])
+
+    def test_stats_count_changed_threads(self):
+        fingerprints = ThreadFingerprints(maxsize=10)
+        thread = make_thread("1", "a")
+        fingerprints.filter_changed(1, [thread])
+        fingerprints.commit(1, thread)
+        fingerprints.filter_changed(1, [thread])
+        # A stored fingerprint that differs is a cache hit, but the thread changed
+        changed_thread = make_thread("1", "a", "b")
+        self.assertEqual(fingerprints.filter_changed(1, [changed_thread]), [changed_thread])
+
+        self.assertEqual(fingerprints.stats, {"size": 1, "unchanged": 1, "changed": 2, "unchanged_rate": 0.333})
@@ -0,0 +1,21 @@
+import asyncio
+import time
+import unittest
+
+from base.rate_limit import TokenBucket
+
+
+class TokenBucketTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=50, capacity=2)
+        started_at = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        # Two tokens of the burst right away, the other two at 50 per second
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.035)
+
+    async def test_waiters_share_the_rate(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        started_at = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(5)))
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.035)
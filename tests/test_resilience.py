@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from aiohttp import ClientConnectionError, ClientResponseError
+from base import resilience
+from base.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, call_with_retry, is_retryable
+
+
+def response_error(status: int) -> ClientResponseError:
+    return ClientResponseError(mock.Mock(real_url="http://upstream"), (), status=status)
+
+
+class FailingCall:
+    """Coroutine function raising the given errors one by one before returning"""
+
+    def __init__(self, *errors: Exception) -> None:
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(resilience.time, "monotonic", return_value=100.0)
+        self.monotonic = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+
+    def fail(self) -> None:
+        with self.assertRaises(ValueError), self.breaker:
+            raise ValueError("failed")
+
+    def test_opens_after_failures_in_a_row(self):
+        self.fail()
+        with self.breaker:
+            pass
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError), self.breaker:
+            pass
+
+    def test_single_trial_call_after_reset_timeout(self):
+        self.fail()
+        self.fail()
+        self.monotonic.return_value = 111.0
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        # Another call waits for the result of the trial
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+
+        self.monotonic.return_value = 122.0
+        with self.breaker:
+            pass
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_open_breaker_of_another_dependency_is_not_a_failure(self):
+        for _ in range(3):
+            with self.assertRaises(CircuitOpenError), self.breaker:
+                raise CircuitOpenError("other", 1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+class RetryTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(resilience, "get_backoff_delay", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retryable_errors(self):
+        for error in (response_error(429), response_error(502), ClientConnectionError(), asyncio.TimeoutError()):
+            self.assertTrue(is_retryable(error))
+        for error in (response_error(400), response_error(404), ValueError()):
+            self.assertFalse(is_retryable(error))
+
+    def test_retries_until_success(self):
+        func = FailingCall(response_error(503), ClientConnectionError())
+        self.assertEqual(asyncio.run(call_with_retry(func, "test", attempts=3)), "ok")
+        self.assertEqual(func.calls, 3)
+
+    def test_gives_up_after_attempts(self):
+        func = FailingCall(response_error(503), response_error(503))
+        with self.assertRaises(ClientResponseError):
+            asyncio.run(call_with_retry(func, "test", attempts=2))
+        self.assertEqual(func.calls, 2)
+
+    def test_client_error_is_not_retried(self):
+        func = FailingCall(response_error(422))
+        with self.assertRaises(ClientResponseError):
+            asyncio.run(call_with_retry(func, "test", attempts=3))
+        self.assertEqual(func.calls, 1)
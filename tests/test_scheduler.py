@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+from base import scheduler
+from base.scheduler import AdaptivePollScheduler
+
+
+class AdaptivePollSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(scheduler.time, "monotonic", return_value=0.0)
+        self.monotonic = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = AdaptivePollScheduler(min_interval=10, max_interval=40, backoff_factor=2)
+
+    def test_idle_keys_back_off_and_active_keys_reset(self):
+        self.scheduler.add("blogger")
+        self.assertEqual(self.scheduler.pop_due(), ["blogger"])
+        intervals = []
+        for _ in range(4):
+            intervals.append(self.scheduler.record("blogger", active=False))
+        self.assertEqual(intervals, [20, 40, 40, 40])
+        self.assertEqual(self.scheduler.record("blogger", active=True), 10)
+
+    def test_keys_are_due_in_order_and_only_once(self):
+        self.scheduler.add("first")
+        self.scheduler.add("second")
+        self.assertEqual(self.scheduler.pop_due(limit=1), ["first"])
+        self.scheduler.record("first", active=True)
+        # A key being polled isn't handed out again
+        self.assertFalse(self.scheduler.take("first"))
+        self.assertEqual(self.scheduler.pop_due(), ["second"])
+        self.scheduler.record("second", active=False)
+
+        self.assertEqual(self.scheduler.next_due_in(), 10)
+        self.monotonic.return_value = 10.0
+        self.assertEqual(self.scheduler.pop_due(), ["first"])
+        self.assertEqual(self.scheduler.next_due_in(), 10)
+
+    def test_own_min_interval_and_removed_keys(self):
+        self.scheduler.add("slow", min_interval=60)
+        self.scheduler.add("removed")
+        self.scheduler.retain(["slow"])
+        self.assertEqual(self.scheduler.pop_due(), ["slow"])
+        # The cap of a key is at least its own min interval
+        self.assertEqual(self.scheduler.record("slow", active=False), 60)
+        self.assertNotIn("removed", self.scheduler)
+        self.assertEqual(len(self.scheduler), 1)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import consumer
+from api.schemas import GeneratedMessageStatusUpdate
+from base.fingerprints import ThreadFingerprints
+from base.sharding import Shard
+from base.status_buffer import StatusUpdateBuffer
+from base.watermarks import WatermarkStore
+
+BLOGGER_IDS = range(1, 2001)
+
+
+async def send(*_) -> None:
+    pass
+
+
+def make_buffer(path: str, updates: list[tuple[int, str, float]] = ()) -> StatusUpdateBuffer:
+    buffer = StatusUpdateBuffer(send, send, path=path)
+    for id_, status, created_at in updates:
+        buffer._connection.execute(
+            "INSERT INTO status_updates (id, status, created_at) VALUES (?, ?, ?)", (id_, status, created_at)
+        )
+    buffer._connection.commit()
+    return buffer
+
+
+def read_updates(buffer: StatusUpdateBuffer) -> list[tuple[int, str]]:
+    return buffer._connection.execute("SELECT id, status FROM status_updates ORDER BY id").fetchall()
+
+
+class ShardTestCase(unittest.TestCase):
+    def test_every_blogger_has_one_owner(self):
+        for count in (1, 2, 5):
+            shards = [Shard(index, count) for index in range(count)]
+            for blogger_id in BLOGGER_IDS:
+                self.assertEqual(sum(shard.owns(blogger_id) for shard in shards), 1)
+
+    def test_removing_a_shard_only_moves_its_bloggers(self):
+        for blogger_id in BLOGGER_IDS:
+            owner = Shard(0, 5).get_owner(blogger_id)
+            if owner < 4:
+                self.assertEqual(Shard(0, 4).get_owner(blogger_id), owner)
+
+    def test_bloggers_are_spread(self):
+        owners = [Shard(0, 4).get_owner(blogger_id) for blogger_id in BLOGGER_IDS]
+        for index in range(4):
+            self.assertGreater(owners.count(index), len(BLOGGER_IDS) / 8)
+
+    def test_invalid_shard(self):
+        for index, count in ((1, 1), (-1, 2), (0, 0)):
+            with self.subTest(index=index, count=count), self.assertRaises(ValueError):
+                Shard(index, count)
+
+    def test_paths(self):
+        self.assertEqual(Shard(0, 1).get_path("state/buffer.sqlite3"), "state/buffer.sqlite3")
+        self.assertEqual(Shard(2, 3).get_path("state/buffer.sqlite3"), "state/buffer.shard-2.sqlite3")
+        self.assertIsNone(Shard(2, 3).get_path(None))
+
+    def test_orphaned_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "buffer.sqlite3")
+            for name in ("buffer", "buffer.shard-0", "buffer.shard-3", "buffer.shard-x"):
+                open(os.path.join(directory, f"{name}.sqlite3"), "w").close()
+            orphaned = [os.path.basename(item) for item in Shard(0, 2).get_orphaned_paths(path)]
+            self.assertEqual(orphaned, ["buffer.shard-3.sqlite3", "buffer.sqlite3"])
+            orphaned = [os.path.basename(item) for item in Shard(0, 1).get_orphaned_paths(path)]
+            self.assertEqual(orphaned, ["buffer.shard-0.sqlite3", "buffer.shard-3.sqlite3"])
+
+
+class OrphanedStatusBuffersTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "buffer.sqlite3")
+        patcher = mock.patch.object(consumer, "STATUS_BUFFER_PATH", self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stopped_shard_is_merged(self):
+        shard = Shard(0, 2)
+        orphan_path = Shard(2, 3).get_path(self.path)
+        orphan = make_buffer(orphan_path, [(1, "sent", 10), (2, "error", 10), (3, "sent", 30)])
+        # Stopped without flushing, like a consumer killed while the wrapper was down
+        orphan._connection.close()
+        buffer = make_buffer(shard.get_path(self.path), [(2, "sent", 20), (3, "error", 20)])
+        self.addCleanup(buffer._connection.close)
+
+        consumer.merge_orphaned_status_buffers(buffer, shard)
+
+        # The newer update of a message wins, the store of the removed shard is gone
+        self.assertEqual(read_updates(buffer), [(1, "sent"), (2, "sent"), (3, "sent")])
+        self.assertEqual(shard.get_orphaned_paths(self.path), [])
+        for suffix in ("", "-wal", "-shm"):
+            self.assertFalse(os.path.exists(orphan_path + suffix))
+
+    def test_running_shard_is_left_alone(self):
+        shard = Shard(0, 2)
+        orphan_path = Shard(2, 3).get_path(self.path)
+        orphan = make_buffer(orphan_path, [(1, "sent", 10)])
+        buffer = make_buffer(shard.get_path(self.path))
+        self.addCleanup(buffer._connection.close)
+
+        consumer.merge_orphaned_status_buffers(buffer, shard)
+        self.assertEqual(read_updates(buffer), [])
+        # The running consumer keeps writing to its store and the updates are merged after it stopped
+        asyncio.run(orphan.add(GeneratedMessageStatusUpdate(id=2, status="sent")))
+        orphan._connection.close()
+        consumer.merge_orphaned_status_buffers(buffer, shard)
+        self.assertEqual(read_updates(buffer), [(1, "sent"), (2, "sent")])
+        self.assertFalse(os.path.exists(orphan_path))
+
+    def test_merged_store_is_not_created_again(self):
+        buffer = make_buffer(self.path)
+        self.addCleanup(buffer._connection.close)
+        missing_path = Shard(2, 3).get_path(self.path)
+        with self.assertRaises(sqlite3.OperationalError):
+            buffer.merge(missing_path)
+        self.assertFalse(os.path.exists(missing_path))
+
+
+class ShardStateTestCase(unittest.TestCase):
+    def test_state_is_loaded_from_the_shard_path(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "watermarks.json")
+            with open(path, "w") as file:
+                json.dump({"1": 100.0}, file)
+            with open(Shard(1, 2).get_path(path), "w") as file:
+                json.dump({"2": 200.0}, file)
+
+            # Nothing is read before the worker sets the path of its shard
+            store = WatermarkStore(path)
+            self.assertIsNone(store.get(1))
+            store.path = Shard(1, 2).get_path(path)
+            store.load()
+            self.assertEqual((store.get(1), store.get(2)), (None, 200.0))
+
+            fingerprints_path = os.path.join(directory, "fingerprints.json")
+            with open(fingerprints_path, "w") as file:
+                json.dump({"1:thread": "fingerprint"}, file)
+            self.assertEqual(len(list(ThreadFingerprints(10, fingerprints_path)._fingerprints.items())), 0)
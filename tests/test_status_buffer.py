@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from aiohttp import ClientConnectionError, ClientResponseError
+from api.schemas import GeneratedMessageStatusUpdate
+from base.metrics import status_updates_rejected
+from base.status_buffer import StatusUpdateBuffer
+
+
+def response_error(status: int) -> ClientResponseError:
+    return ClientResponseError(mock.Mock(real_url="http://wrapper"), (), status=status)
+
+
+class FakeWrapper:
+    """Status endpoints failing with the errors set for the bulk endpoint and for single message ids"""
+
+    def __init__(self, bulk_error: Exception = None, errors: dict[int, Exception] = None) -> None:
+        self.bulk_error = bulk_error
+        self.errors = errors or {}
+        self.updated: list[int] = []
+
+    async def send_bulk(self, updates: list[GeneratedMessageStatusUpdate]) -> None:
+        if self.bulk_error is not None:
+            raise self.bulk_error
+        self.updated.extend(update.id for update in updates)
+
+    async def send_single(self, update: GeneratedMessageStatusUpdate) -> None:
+        if update.id in self.errors:
+            raise self.errors[update.id]
+        self.updated.append(update.id)
+
+
+def flush(wrapper: FakeWrapper, ids: list[int]) -> StatusUpdateBuffer:
+    async def run() -> StatusUpdateBuffer:
+        buffer = StatusUpdateBuffer(wrapper.send_bulk, wrapper.send_single, max_size=1000)
+        for id_ in ids:
+            await buffer.add(GeneratedMessageStatusUpdate(id=id_, status="sent"))
+        await buffer.flush()
+        return buffer
+
+    return asyncio.run(run())
+
+
+class StatusUpdateBufferFlushTestCase(unittest.TestCase):
+    def test_bulk(self):
+        wrapper = FakeWrapper()
+        buffer = flush(wrapper, [1, 2, 3])
+        self.assertEqual(wrapper.updated, [1, 2, 3])
+        self.assertEqual(buffer.pending_ids(), set())
+
+    def test_retryable_bulk_error_keeps_updates(self):
+        for error in (response_error(500), response_error(429), ClientConnectionError(), asyncio.TimeoutError()):
+            with self.subTest(error=error):
+                wrapper = FakeWrapper(bulk_error=error)
+                buffer = flush(wrapper, [1, 2])
+                self.assertEqual(wrapper.updated, [])
+                self.assertEqual(buffer.pending_ids(), {1, 2})
+                self.assertTrue(buffer.bulk_supported)
+
+    def test_rejected_bulk_falls_back_to_single_updates(self):
+        rejected = status_updates_rejected.value(status=422)
+        wrapper = FakeWrapper(bulk_error=response_error(400), errors={2: response_error(422)})
+        buffer = flush(wrapper, [1, 2, 3])
+        # The rejected update is dropped, the others are sent and the bulk endpoint is tried again next time
+        self.assertEqual(wrapper.updated, [1, 3])
+        self.assertEqual(buffer.pending_ids(), set())
+        self.assertTrue(buffer.bulk_supported)
+        self.assertEqual(status_updates_rejected.value(status=422), rejected + 1)
+
+    def test_missing_bulk_endpoint(self):
+        wrapper = FakeWrapper(bulk_error=response_error(404))
+        buffer = flush(wrapper, [1, 2])
+        self.assertEqual(wrapper.updated, [1, 2])
+        self.assertFalse(buffer.bulk_supported)
+
+    def test_retryable_single_error_keeps_update(self):
+        wrapper = FakeWrapper(bulk_error=response_error(405), errors={1: response_error(503)})
+        buffer = flush(wrapper, [1, 2])
+        self.assertEqual(wrapper.updated, [2])
+        self.assertEqual(buffer.pending_ids(), {1})
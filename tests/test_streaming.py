@@ -0,0 +1,83 @@
+import asyncio
+import json
+import unittest
+
+from base.streaming import iter_json_array
+
+
+class FakeContent:
+    """Byte stream returning at most `chunk_size` bytes per read, like a response arriving in small pieces"""
+
+    def __init__(self, body: bytes, chunk_size: int) -> None:
+        self.body = body
+        self.chunk_size = chunk_size
+        self.position = 0
+
+    async def read(self, n: int = -1) -> bytes:
+        size = min(n, self.chunk_size) if n > 0 else self.chunk_size
+        chunk = self.body[self.position : self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+
+def collect(body: bytes, chunk_size: int, key: str = "data") -> list:
+    async def run() -> list:
+        return [item async for item in iter_json_array(FakeContent(body, chunk_size), key, chunk_size)]
+
+    return asyncio.run(run())
+
+
+class IterJSONArrayTestCase(unittest.TestCase):
+    def assert_every_chunk_size(self, payload: dict, key: str = "data") -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        for chunk_size in range(1, len(body) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(collect(body, chunk_size, key), payload.get(key, []))
+
+    def test_numbers(self):
+        self.assert_every_chunk_size({"took": 12.5, "data": [1, -20, 3.25, 1e21, -4.5e-7, 0, 123456789]})
+
+    def test_number_before_the_array(self):
+        self.assert_every_chunk_size({"took": 12.5, "data": [{"id": 1}]})
+
+    def test_strings_and_escapes(self):
+        self.assert_every_chunk_size(
+            {"data": ["plain", 'quote " and \\ backslash', "line\nbreak\ttab", "é中\U0001f600", ""]}
+        )
+
+    def test_nested_values(self):
+        self.assert_every_chunk_size(
+            {
+                "success": True,
+                "data": [
+                    {"id": 1, "messages": [{"text": "hi", "created_at": 1700000000.5}], "flag": None},
+                    {"id": 2, "messages": [], "tags": {"a": [True, False, None]}},
+                    [[1, 2], {"nested": {"deep": [3.5]}}],
+                ],
+                "next_cursor": None,
+            }
+        )
+
+    def test_other_keys_are_skipped(self):
+        self.assert_every_chunk_size({"meta": {"data": [9]}, "count": 2, "data": [{"id": 1}, {"id": 2}], "tail": 1})
+
+    def test_empty_and_missing_array(self):
+        self.assert_every_chunk_size({"data": []})
+        self.assert_every_chunk_size({"other": [1]})
+        self.assertEqual(collect(b"{}", 1), [])
+
+    def test_whitespace(self):
+        body = b' {\n  "data" : [ 1 ,\t2.5 , {"a" : 1e2} ]\n}\n'
+        for chunk_size in range(1, len(body) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(collect(body, chunk_size), [1, 2.5, {"a": 100.0}])
+
+    def test_truncated_body(self):
+        body = b'{"data": [{"id": 1}, {"id": '
+        for chunk_size in (1, 7, len(body)):
+            with self.subTest(chunk_size=chunk_size), self.assertRaises(ValueError):
+                collect(body, chunk_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
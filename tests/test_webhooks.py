@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import unittest
+from unittest import mock
+
+from api.webhooks import is_valid_signature, parse_webhook_payload, webhook_processor
+from configs import FACEBOOK_APP_SECRET, FACEBOOK_WEBHOOK_VERIFY_TOKEN
+from fastapi.testclient import TestClient
+from main import app
+
+URL = "/v1/api/webhooks/instagram"
+
+
+def sign(body: bytes) -> str:
+    return "sha256=" + hmac.new(FACEBOOK_APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def messaging_item(sender_id: str, recipient_id: str, mid: str, timestamp: int, **message) -> dict:
+    return {
+        "sender": {"id": sender_id},
+        "recipient": {"id": recipient_id},
+        "timestamp": timestamp,
+        "message": {"mid": mid, **message},
+    }
+
+
+ATTACHMENTS = [{"type": "image", "payload": {"url": "https://example.com/image.jpg"}}]
+
+PAYLOAD = {
+    "object": "instagram",
+    "entry": [
+        {
+            "id": "account",
+            "messaging": [
+                messaging_item("user", "account", "m2", 2000, text="second"),
+                messaging_item("account", "user", "m1", 1000, text="first", is_echo=True),
+                messaging_item("other", "account", "m3", 3000, attachments=ATTACHMENTS),
+                messaging_item("user", "account", "m4", 4000, text="deleted", is_deleted=True),
+                {"sender": {"id": "user"}, "recipient": {"id": "account"}, "timestamp": 5000, "read": {"mid": "m2"}},
+            ],
+        }
+    ],
+}
+
+
+class ParseWebhookPayloadTestCase(unittest.TestCase):
+    def test_signature(self):
+        body = b'{"object": "instagram"}'
+        self.assertTrue(is_valid_signature(body, sign(body)))
+        self.assertFalse(is_valid_signature(body + b" ", sign(body)))
+        self.assertFalse(is_valid_signature(body, sign(body).removeprefix("sha256=")))
+        self.assertFalse(is_valid_signature(body, None))
+        self.assertFalse(is_valid_signature(body, sign(body), app_secret=""))
+
+    def test_groups_messages_by_conversation(self):
+        events = parse_webhook_payload(PAYLOAD)
+        conversations = [(event.account_id, event.user_id) for event in events]
+        self.assertEqual(conversations, [("account", "user"), ("account", "other")])
+
+        first, second = events[0].messages
+        self.assertEqual((first.instagram_id_from_official_graph_api, first.sender), ("m1", "blogger"))
+        self.assertEqual((second.instagram_id_from_official_graph_api, second.sender), ("m2", "external_user"))
+        self.assertEqual(second.created_at, 2)
+
+        (attachment,) = events[1].messages
+        self.assertEqual((attachment.item_type, attachment.text), ("image", None))
+        self.assertEqual(attachment.link, ATTACHMENTS[0]["payload"]["url"])
+
+    def test_other_objects_are_ignored(self):
+        self.assertEqual(parse_webhook_payload({**PAYLOAD, "object": "page"}), [])
+
+
+class WebhookEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        # Without the lifespan, so no workers or HTTP sessions are started
+        self.client = TestClient(app)
+
+    def post(self, body: bytes, signature: str = None):
+        return self.client.post(URL, content=body, headers={"X-Hub-Signature-256": signature or sign(body)})
+
+    def test_verification(self):
+        params = {"hub.mode": "subscribe", "hub.verify_token": FACEBOOK_WEBHOOK_VERIFY_TOKEN, "hub.challenge": "42"}
+        response = self.client.get(URL, params=params)
+        self.assertEqual((response.status_code, response.text), (200, "42"))
+
+        response = self.client.get(URL, params={**params, "hub.verify_token": "wrong"})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["error_code"], "webhook.invalid_verify_token")
+
+    def test_invalid_signature_is_rejected(self):
+        body = json.dumps(PAYLOAD).encode()
+        response = self.post(body, signature=sign(b"other body"))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["error_code"], "webhook.invalid_signature")
+
+    def test_malformed_payload_is_rejected(self):
+        for body in (b"not json", b"[]", b'{"object": "instagram", "entry": [{"messaging": []}]}'):
+            with self.subTest(body=body):
+                response = self.post(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["error_code"], "webhook.invalid_payload")
+
+    def test_events_are_queued(self):
+        with mock.patch.object(webhook_processor, "put") as put:
+            response = self.post(json.dumps(PAYLOAD).encode())
+        self.assertEqual((response.status_code, response.json()), (200, {"Success": True}))
+        self.assertEqual([call.args[0].user_id for call in put.call_args_list], ["user", "other"])
+
+    def test_full_queue_is_rejected(self):
+        with mock.patch.object(webhook_processor, "put", side_effect=asyncio.QueueFull):
+            response = self.post(json.dumps(PAYLOAD).encode())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["error_code"], "webhook.queue_full")